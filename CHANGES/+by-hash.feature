@@ -0,0 +1 @@
+Added a ``by_hash`` option to apt publications, which additionally publishes the indices below ``by-hash`` directories, keeping the by-hash files of previous publications for a few versions.
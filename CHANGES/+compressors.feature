@@ -0,0 +1 @@
+Added a ``compressors`` option to apt publications, which selects the compressed variants (``gz``, ``bz2`` and ``xz``) of the published Packages indices.
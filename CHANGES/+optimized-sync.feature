@@ -0,0 +1 @@
+Added an ``optimize`` option to the sync endpoint, which skips parsing package indices that are unchanged since the latest repository version, if it was synced from the same remote with the same mirror setting.
@@ -0,0 +1 @@
+Added a ``package_index_preference`` option to remotes, which sets the order in which the Packages index variants listed in a Release file are tried. Only one variant is downloaded per sync, the others are fetched on demand.
@@ -0,0 +1 @@
+Added ``max_concurrent_distributions``, ``max_concurrent_components`` and ``max_concurrent_indices`` options to remotes, which limit how many distributions, components and indices are synchronized at a time.
@@ -11,3 +11,28 @@ CHECKSUM_TYPE_MAP = {
     "sha256": "SHA256",
     "sha512": "SHA512",
 }
+
+# Maps the compressors supported for published Packages indices onto their default level:
+PACKAGE_INDEX_COMPRESSORS = {
+    "gz": 9,
+    "bz2": 9,
+    "xz": 6,
+}
+
+# Maps the Packages index variants a remote may prefer onto their file names:
+PACKAGE_INDEX_VARIANTS = {
+    "xz": "Packages.xz",
+    "gz": "Packages.gz",
+    "bz2": "Packages.bz2",
+    "plain": "Packages",
+}
+
+# The number of bytes of a Packages index that are parsed by a process of the sync parse pool at a
+# time:
+PACKAGE_INDEX_CHUNK_SIZE = 2**20
+
+# The number of packages of a Packages index that are resolved by a sync at a time:
+PACKAGE_WINDOW_SIZE = 1000
+
+# The number of GPG keyrings of remotes, that are cached across syncs:
+GPG_KEYRING_CACHE_SIZE = 32
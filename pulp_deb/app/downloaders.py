@@ -0,0 +1,121 @@
+import bz2
+import hashlib
+import lzma
+import os
+import zlib
+
+from tempfile import NamedTemporaryFile
+from urllib.parse import urlparse
+
+from pulpcore.plugin.download import FileDownloader, HttpDownloader
+from pulpcore.plugin.exceptions import DigestValidationError
+from pulpcore.plugin.models import Artifact
+
+
+# Maps the file extensions of compressed package indices onto their decompressor factories:
+DECOMPRESSORS = {
+    ".gz": lambda: zlib.decompressobj(zlib.MAX_WBITS | 32),
+    ".bz2": bz2.BZ2Decompressor,
+    ".xz": lzma.LZMADecompressor,
+}
+
+
+class DecompressingDownloaderMixin:
+    """
+    A downloader mixin, that can decompress the downloaded data on the fly.
+
+    If decompress is set, the uncompressed file is written and hashed in the same pass that writes
+    and hashes the compressed file. The compression algorithm is chosen by the file extension of
+    the url. Otherwise the downloader behaves like the one it is mixed into.
+    """
+
+    def __init__(
+        self,
+        *args,
+        decompress=False,
+        expected_uncompressed_digests=None,
+        uncompressed_stream=None,
+        **kwargs,
+    ):
+        """
+        A downloader mixin, that can decompress the downloaded data on the fly.
+
+        Args:
+            decompress (bool): Whether to decompress the downloaded data.
+            expected_uncompressed_digests (dict): Keyed on the algorithm name provided by hashlib
+                and stores the value of the expected digest of the uncompressed file.
+            uncompressed_stream (PackageIndexStream): Informed about the uncompressed data written.
+
+        """
+        super().__init__(*args, **kwargs)
+        self.decompress = decompress
+        self.expected_uncompressed_digests = expected_uncompressed_digests
+        self.uncompressed_stream = uncompressed_stream
+        self.uncompressed_path = None
+        self.uncompressed_artifact_attributes = None
+        self._decompressor = None
+
+    def _ensure_decompressor(self):
+        if self._decompressor is None:
+            extension = os.path.splitext(urlparse(self.url).path)[1]
+            self._decompressor = DECOMPRESSORS[extension]()
+            self._uncompressed_writer = NamedTemporaryFile(dir=os.getcwd(), delete=False)
+            self.uncompressed_path = self._uncompressed_writer.name
+            self._uncompressed_digests = {n: hashlib.new(n) for n in Artifact.DIGEST_FIELDS}
+            self._uncompressed_size = 0
+            if self.uncompressed_stream:
+                self.uncompressed_stream.start(self.uncompressed_path)
+
+    def _handle_uncompressed_data(self, data):
+        self._uncompressed_writer.write(data)
+        for digest in self._uncompressed_digests.values():
+            digest.update(data)
+        self._uncompressed_size += len(data)
+        if self.uncompressed_stream and data:
+            self._uncompressed_writer.flush()
+            self.uncompressed_stream.grow(self._uncompressed_size)
+
+    async def handle_data(self, data):
+        """
+        Write, hash, and decompress the data, then write and hash the uncompressed data.
+        """
+        await super().handle_data(data)
+        if self.decompress:
+            self._ensure_decompressor()
+            self._handle_uncompressed_data(self._decompressor.decompress(data))
+
+    async def finalize(self):
+        """
+        Finalize the compressed file, then close and validate the uncompressed file.
+
+        Raises:
+            :class:`~pulpcore.exceptions.DigestValidationError`: When any of the
+                ``expected_uncompressed_digests`` do not match the uncompressed data.
+
+        """
+        await super().finalize()
+        if not self.decompress:
+            return
+        self._ensure_decompressor()
+        if hasattr(self._decompressor, "flush"):
+            self._handle_uncompressed_data(self._decompressor.flush())
+        self._uncompressed_writer.close()
+        self.uncompressed_artifact_attributes = {
+            name: digest.hexdigest() for name, digest in self._uncompressed_digests.items()
+        }
+        self.uncompressed_artifact_attributes["size"] = self._uncompressed_size
+        for name, value in (self.expected_uncompressed_digests or {}).items():
+            if self.uncompressed_artifact_attributes.get(name) != value:
+                raise DigestValidationError(self.url)
+
+
+class DecompressingHttpDownloader(DecompressingDownloaderMixin, HttpDownloader):
+    """
+    An HttpDownloader, that can decompress the downloaded data on the fly.
+    """
+
+
+class DecompressingFileDownloader(DecompressingDownloaderMixin, FileDownloader):
+    """
+    A FileDownloader, that can decompress the downloaded data on the fly.
+    """
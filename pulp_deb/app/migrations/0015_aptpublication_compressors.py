@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-17 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0014_swap_distribution_model'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aptpublication',
+            name='compressors',
+            field=models.CharField(blank=True, default='gz', max_length=255),
+        ),
+    ]
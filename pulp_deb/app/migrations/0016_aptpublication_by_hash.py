@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-17 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0015_aptpublication_compressors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aptpublication',
+            name='by_hash',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.19 on 2026-10-17 13:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0016_aptpublication_by_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aptremote',
+            name='package_index_preference',
+            field=models.CharField(default='xz gz bz2 plain', max_length=255),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.19 on 2026-10-17 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0017_aptremote_package_index_preference'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aptremote',
+            name='max_concurrent_distributions',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='aptremote',
+            name='max_concurrent_components',
+            field=models.PositiveIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='aptremote',
+            name='max_concurrent_indices',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.19 on 2026-10-17 14:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0018_aptremote_max_concurrency'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='installerpackage',
+            index=models.Index(fields=['package', 'version', 'architecture'], name='deb_install_package_effcf4_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='installerpackage',
+            index=models.Index(fields=['sha256'], name='deb_install_sha256_6b6b78_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['package', 'version', 'architecture'], name='deb_package_package_336214_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='package',
+            index=models.Index(fields=['sha256'], name='deb_package_sha256_1fc3e1_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 2.2.19 on 2026-10-17 15:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django_lifecycle.mixins
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0019_package_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PackageStanza',
+            fields=[
+                ('pulp_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('pulp_created', models.DateTimeField(auto_now_add=True)),
+                ('pulp_last_updated', models.DateTimeField(auto_now=True, null=True)),
+                ('component', models.CharField(max_length=255)),
+                ('format_version', models.PositiveIntegerField()),
+                ('checksums', models.CharField(max_length=64)),
+                ('stanza', models.TextField()),
+                ('package', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deb_packagestanza', to='deb.Package')),
+            ],
+            options={
+                'default_related_name': '%(app_label)s_%(model_name)s',
+                'unique_together': {('package', 'component', 'format_version', 'checksums')},
+            },
+            bases=(django_lifecycle.mixins.LifecycleModelMixin, models.Model),
+        ),
+        migrations.AddIndex(
+            model_name='packagestanza',
+            index=models.Index(fields=['pulp_last_updated'], name='deb_package_pulp_la_a66d0c_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 2.2.19 on 2026-10-17 16:05
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('deb', '0020_packagestanza'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='aptrepository',
+            name='last_sync_remote',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='deb_aptrepository', to='deb.AptRemote'),
+        ),
+        migrations.AddField(
+            model_name='aptrepository',
+            name='last_sync_remote_updated',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='aptrepository',
+            name='last_sync_mirror',
+            field=models.BooleanField(null=True),
+        ),
+        migrations.AddField(
+            model_name='aptrepository',
+            name='last_sync_repository_version',
+            field=models.PositiveIntegerField(null=True),
+        ),
+    ]
@@ -205,6 +205,12 @@ class BasePackage(Content):
     class Meta:
         default_related_name = "%(app_label)s_%(model_name)s"
         unique_together = (("relative_path", "sha256"),)
+        indexes = [
+            # Used to find packages by their repo_key_fields, e.g. by the package filter
+            models.Index(fields=["package", "version", "architecture"]),
+            # Used to find packages by their sha256 alone, e.g. by the package filter
+            models.Index(fields=["sha256"]),
+        ]
         abstract = True
 
 
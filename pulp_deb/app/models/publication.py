@@ -1,7 +1,9 @@
 from django.db import models
 
-from pulpcore.plugin.models import Publication, Distribution
+from pulpcore.plugin.models import BaseModel, Publication, Distribution
 
+from pulp_deb.app.constants import PACKAGE_INDEX_COMPRESSORS
+from pulp_deb.app.models.content import Package
 from pulp_deb.app.models.signing_service import AptReleaseSigningService
 
 
@@ -35,6 +37,38 @@ class AptPublication(Publication):
     signing_service = models.ForeignKey(
         AptReleaseSigningService, on_delete=models.PROTECT, null=True
     )
+    compressors = models.CharField(max_length=255, default="gz", blank=True)
+    by_hash = models.BooleanField(default=False)
+
+    @staticmethod
+    def parse_compressors(compressors):
+        """
+        Parse a whitespace separated list of Packages index compressors.
+
+        Every compressor may be followed by a colon and a compression level, e.g. "xz:9 gz".
+
+        Returns:
+            dict: Maps the names of the compressors onto their compression levels.
+
+        Raises:
+            ValueError: If a compressor or level is not supported.
+        """
+        ret = {}
+        for compressor in compressors.split():
+            name, _, level = compressor.partition(":")
+            if name not in PACKAGE_INDEX_COMPRESSORS:
+                raise ValueError(
+                    "Unsupported compressor '{}', choose from: {}".format(
+                        name, ", ".join(PACKAGE_INDEX_COMPRESSORS)
+                    )
+                )
+            if not level:
+                ret[name] = PACKAGE_INDEX_COMPRESSORS[name]
+            elif level.isdigit() and 1 <= int(level) <= 9:
+                ret[name] = int(level)
+            else:
+                raise ValueError("Compression level of '{}' must be between 1 and 9.".format(name))
+        return ret
 
     class Meta:
         default_related_name = "%(app_label)s_%(model_name)s"
@@ -49,3 +83,27 @@ class AptDistribution(Distribution):
 
     class Meta:
         default_related_name = "%(app_label)s_%(model_name)s"
+
+
+class PackageStanza(BaseModel):
+    """
+    A rendered Packages stanza of a package, cached for later publications.
+
+    Stanzas are keyed by the package, the component it is published in, a digest of the checksums
+    of its artifact, which are all the inputs of the rendering, and the version of the rendering
+    itself. The pulp_last_updated timestamp is updated whenever a stanza is used.
+    """
+
+    package = models.ForeignKey(Package, on_delete=models.CASCADE)
+    component = models.CharField(max_length=255)
+    format_version = models.PositiveIntegerField()
+    checksums = models.CharField(max_length=64)
+    stanza = models.TextField()
+
+    class Meta:
+        default_related_name = "%(app_label)s_%(model_name)s"
+        unique_together = (("package", "component", "format_version", "checksums"),)
+        indexes = [
+            # Used to evict the least recently used stanzas
+            models.Index(fields=["pulp_last_updated"]),
+        ]
@@ -1,7 +1,10 @@
 from django.db import models
 
+from pulpcore.plugin.download import DownloaderFactory
 from pulpcore.plugin.models import Remote
 
+from pulp_deb.app.downloaders import DecompressingFileDownloader, DecompressingHttpDownloader
+
 
 class AptRemote(Remote):
     """
@@ -18,6 +21,31 @@ class AptRemote(Remote):
     sync_installer = models.BooleanField(default=False)
     gpgkey = models.TextField(null=True)
     ignore_missing_package_indices = models.BooleanField(default=False)
+    package_index_preference = models.CharField(max_length=255, default="xz gz bz2 plain")
+    max_concurrent_distributions = models.PositiveIntegerField(null=True)
+    max_concurrent_components = models.PositiveIntegerField(null=True)
+    max_concurrent_indices = models.PositiveIntegerField(null=True)
 
     class Meta:
         default_related_name = "%(app_label)s_%(model_name)s"
+
+    @property
+    def download_factory(self):
+        """
+        Return the DownloaderFactory, whose downloaders can decompress package indices.
+
+        Package indices are downloaded using the same session and concurrency limit as any other
+        file of the remote, passing decompress=True to get_downloader().
+        """
+        try:
+            return self._download_factory
+        except AttributeError:
+            self._download_factory = DownloaderFactory(
+                self,
+                downloader_overrides={
+                    "http": DecompressingHttpDownloader,
+                    "https": DecompressingHttpDownloader,
+                    "file": DecompressingFileDownloader,
+                },
+            )
+            return self._download_factory
@@ -1,3 +1,5 @@
+from django.db import models
+
 from pulpcore.plugin.models import Repository
 
 from pulpcore.plugin.repo_version_utils import remove_duplicates, validate_repo_version
@@ -39,6 +41,11 @@ class AptRepository(Repository):
         AptRemote,
     ]
 
+    last_sync_remote = models.ForeignKey(AptRemote, null=True, on_delete=models.SET_NULL)
+    last_sync_remote_updated = models.DateTimeField(null=True)
+    last_sync_mirror = models.BooleanField(null=True)
+    last_sync_repository_version = models.PositiveIntegerField(null=True)
+
     class Meta:
         default_related_name = "%(app_label)s_%(model_name)s"
 
@@ -23,4 +23,4 @@ from .publication_serializers import (
 
 from .remote_serializers import AptRemoteSerializer
 
-from .repository_serializers import AptRepositorySerializer
+from .repository_serializers import AptRepositorySerializer, AptRepositorySyncURLSerializer
@@ -4,6 +4,8 @@ import os
 
 from debian import deb822, debfile
 
+from django.db.models import F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from rest_framework.serializers import CharField, Field, ValidationError
 from pulpcore.plugin.models import Artifact, RemoteArtifact
 from pulpcore.plugin.serializers import (
@@ -266,29 +268,59 @@ class BasePackage822Serializer(SingleArtifactContentSerializer):
 
     def to822(self, component=""):
         """Create deb822.Package object from model."""
+        return self.model_to822(self.instance, component)
+
+    @staticmethod
+    def annotate_artifacts(queryset):
+        """
+        Annotate a queryset of packages with their ContentArtifact pk and artifact checksums.
+
+        The checksums are taken from the Artifact if it was downloaded, and from a RemoteArtifact
+        otherwise. Packages from the annotated queryset can be converted using model_to822
+        without issuing any further queries.
+        """
+        remote_artifacts = RemoteArtifact.objects.filter(content_artifact__content=OuterRef("pk"))
+        annotations = {"content_artifact_pk": F("contentartifact__pk")}
+        for checksum_type in ("md5", "sha1", "sha256"):
+            annotations["artifact_" + checksum_type] = Coalesce(
+                F("contentartifact__artifact__" + checksum_type),
+                Subquery(remote_artifacts.values(checksum_type)[:1]),
+            )
+        return queryset.annotate(**annotations)
+
+    @classmethod
+    def model_to822(cls, package, component=""):
+        """
+        Create deb822.Package object from a package model instance.
+
+        The paragraph is rendered directly from the model fields. If the package was obtained
+        from a queryset annotated using annotate_artifacts, no queries are issued.
+        """
         ret = deb822.Packages()
 
-        for k, v in self.TRANSLATION_DICT.items():
-            value = self.data.get(k)
-            if value is not None:
-                ret[v] = value
+        for k, v in cls.TRANSLATION_DICT.items():
+            value = getattr(package, k)
+            if value is None:
+                continue
+            if isinstance(value, bool):
+                value = "yes" if value else "no"
+            ret[v] = str(value)
 
-        try:
-            artifact = self.instance._artifacts.get()
-            if artifact.md5:
-                ret["MD5sum"] = artifact.md5
-            if artifact.sha1:
-                ret["SHA1"] = artifact.sha1
-            ret["SHA256"] = artifact.sha256
-        except Artifact.DoesNotExist:
-            artifact = RemoteArtifact.objects.filter(sha256=self.instance.sha256).first()
-            if artifact.md5:
-                ret["MD5sum"] = artifact.md5
-            if artifact.sha1:
-                ret["SHA1"] = artifact.sha1
-            ret["SHA256"] = artifact.sha256
-
-        ret["Filename"] = self.instance.filename(component)
+        if hasattr(package, "artifact_sha256"):
+            md5, sha1, sha256 = package.artifact_md5, package.artifact_sha1, package.artifact_sha256
+        else:
+            try:
+                artifact = package._artifacts.get()
+            except Artifact.DoesNotExist:
+                artifact = RemoteArtifact.objects.filter(sha256=package.sha256).first()
+            md5, sha1, sha256 = artifact.md5, artifact.sha1, artifact.sha256
+        if md5:
+            ret["MD5sum"] = md5
+        if sha1:
+            ret["SHA1"] = sha1
+        ret["SHA256"] = sha256
+
+        ret["Filename"] = package.filename(component)
 
         return ret
 
@@ -1,4 +1,9 @@
-from rest_framework.serializers import BooleanField, ValidationError, HyperlinkedRelatedField
+from rest_framework.serializers import (
+    BooleanField,
+    CharField,
+    ValidationError,
+    HyperlinkedRelatedField,
+)
 from pulpcore.plugin.models import Publication
 from pulpcore.plugin.serializers import (
     DistributionSerializer,
@@ -41,6 +46,29 @@ class AptPublicationSerializer(PublicationSerializer):
         view_name="signing-services-detail",
         required=False,
     )
+    compressors = CharField(
+        help_text="Whitespace separated list of compressors used to publish compressed variants "
+        "of the Packages indices, in addition to the uncompressed ones. Supported compressors are "
+        '"gz", "bz2" and "xz". Each one may be followed by a colon and the compression level, '
+        'i.e. "xz:9 gz".',
+        default="gz",
+        allow_blank=True,
+    )
+    by_hash = BooleanField(
+        help_text="Additionally publish the indices in by-hash directories and set "
+        '"Acquire-By-Hash: yes" in the Release files.',
+        default=False,
+    )
+
+    def validate_compressors(self, value):
+        """
+        Check that all compressors are supported.
+        """
+        try:
+            AptPublication.parse_compressors(value)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        return value
 
     def validate(self, data):
         """
@@ -52,7 +80,13 @@ class AptPublicationSerializer(PublicationSerializer):
         return data
 
     class Meta:
-        fields = PublicationSerializer.Meta.fields + ("simple", "structured", "signing_service")
+        fields = PublicationSerializer.Meta.fields + (
+            "simple",
+            "structured",
+            "signing_service",
+            "compressors",
+            "by_hash",
+        )
         model = AptPublication
 
 
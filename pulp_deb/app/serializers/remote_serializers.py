@@ -1,8 +1,15 @@
-from rest_framework.serializers import BooleanField, CharField, ChoiceField
+from rest_framework.serializers import (
+    BooleanField,
+    CharField,
+    ChoiceField,
+    IntegerField,
+    ValidationError,
+)
 
 from pulpcore.plugin.models import Remote
 from pulpcore.plugin.serializers import RemoteSerializer
 
+from pulp_deb.app.constants import PACKAGE_INDEX_VARIANTS
 from pulp_deb.app.models import AptRemote
 
 
@@ -64,6 +71,41 @@ class AptRemoteSerializer(RemoteSerializer):
         required=False,
     )
 
+    package_index_preference = CharField(
+        help_text="Whitespace separated list of Packages index variants in order of preference. "
+        'Possible variants are "xz", "gz", "bz2" and "plain" (uncompressed). Only the first '
+        "variant that is listed in the Release file is downloaded. The next one is only used "
+        "if that download fails. Variants missing from this list are tried after the listed "
+        "ones.",
+        required=False,
+    )
+
+    max_concurrent_distributions = IntegerField(
+        help_text="The maximum number of distributions that are synchronized concurrently. "
+        "If not set, all distributions are synchronized concurrently.",
+        min_value=1,
+        required=False,
+        allow_null=True,
+    )
+
+    max_concurrent_components = IntegerField(
+        help_text="The maximum number of components that are synchronized concurrently, "
+        "across all distributions. If not set, there is no limit.",
+        min_value=1,
+        required=False,
+        allow_null=True,
+    )
+
+    max_concurrent_indices = IntegerField(
+        help_text="The maximum number of package and installer file indices that are "
+        "downloaded and parsed concurrently, across all components. If not set, there is no "
+        "limit. Lower limits reduce the memory needed to synchronize remotes with many "
+        "distributions, components and architectures.",
+        min_value=1,
+        required=False,
+        allow_null=True,
+    )
+
     policy = ChoiceField(
         help_text="The policy to use when downloading content. The possible values include: "
         "'immediate', 'on_demand', and 'streamed'. 'immediate' is the default.",
@@ -71,6 +113,22 @@ class AptRemoteSerializer(RemoteSerializer):
         default=Remote.IMMEDIATE,
     )
 
+    def validate_package_index_preference(self, value):
+        """
+        Check that all Packages index variants are known.
+        """
+        variants = value.split()
+        if not variants:
+            raise ValidationError("At least one Packages index variant must be provided.")
+        for variant in variants:
+            if variant not in PACKAGE_INDEX_VARIANTS:
+                raise ValidationError(
+                    "Unknown Packages index variant '{}', choose from: {}".format(
+                        variant, ", ".join(PACKAGE_INDEX_VARIANTS)
+                    )
+                )
+        return value
+
     class Meta:
         fields = RemoteSerializer.Meta.fields + (
             "distributions",
@@ -81,5 +139,9 @@ class AptRemoteSerializer(RemoteSerializer):
             "sync_installer",
             "gpgkey",
             "ignore_missing_package_indices",
+            "package_index_preference",
+            "max_concurrent_distributions",
+            "max_concurrent_components",
+            "max_concurrent_indices",
         )
         model = AptRemote
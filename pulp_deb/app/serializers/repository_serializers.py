@@ -1,4 +1,6 @@
-from pulpcore.plugin.serializers import RepositorySerializer
+from rest_framework.serializers import BooleanField
+
+from pulpcore.plugin.serializers import RepositorySerializer, RepositorySyncURLSerializer
 
 from pulp_deb.app.models import AptRepository
 
@@ -11,3 +13,19 @@ class AptRepositorySerializer(RepositorySerializer):
     class Meta:
         fields = RepositorySerializer.Meta.fields
         model = AptRepository
+
+
+class AptRepositorySyncURLSerializer(RepositorySyncURLSerializer):
+    """
+    A Serializer for AptRepository Sync.
+    """
+
+    optimize = BooleanField(
+        help_text="Whether or not to optimize the sync. If enabled, any package indices that are "
+        "unchanged compared to the latest repository version are not parsed again. Instead, the "
+        "packages they reference are carried over from the latest repository version. "
+        "Optimization is skipped unless the latest repository version was synced from the same "
+        "remote with the same mirror setting, and the remote was not changed since.",
+        required=False,
+        default=False,
+    )
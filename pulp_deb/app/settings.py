@@ -6,3 +6,13 @@ Check `Plugin Writer's Guide`_ for more details.
 """
 
 FORBIDDEN_CHECKSUM_WARNINGS = True
+
+# The number of processes used to write the Packages indices of a publication, 1 writes them in
+# the task:
+PUBLISH_WORKERS = 1
+
+# The number of rendered Packages stanzas kept for later publications, 0 disables the cache:
+PUBLISH_STANZA_CACHE_SIZE = 0
+
+# The number of processes used to parse Packages indices during sync, 0 parses them in the task:
+SYNC_PARSE_WORKERS = 0
@@ -1,17 +1,27 @@
+import bz2
+import gzip
+import hashlib
+import lzma
 import os
-import shutil
+import pickle
 
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby, islice
+from operator import attrgetter
 from datetime import datetime, timezone
 from debian import deb822
-from gzip import GzipFile
 import tempfile
 
 from django.conf import settings
 from django.core.files import File
-from django.db.utils import IntegrityError
+from django.db import transaction
+from django.db.models import F, Q
 from django.forms.models import model_to_dict
 
 from pulpcore.plugin.models import (
+    Content,
+    ContentArtifact,
     PublishedArtifact,
     PublishedMetadata,
     RepositoryVersion,
@@ -21,6 +31,7 @@ from pulp_deb.app.models import (
     AptPublication,
     Package,
     PackageReleaseComponent,
+    PackageStanza,
     Release,
     ReleaseArchitecture,
     ReleaseComponent,
@@ -41,6 +52,22 @@ from gettext import gettext as _
 
 log = logging.getLogger(__name__)
 
+# The number of PublishedArtifacts that are buffered before they are saved with a bulk_create:
+PUBLISHED_ARTIFACTS_BATCH_SIZE = 1000
+
+# The number of packages whose cached stanzas are looked up, or that are stored, at a time:
+STANZA_CACHE_BATCH_SIZE = 1000
+
+# The version of the rendering of Packages stanzas, bump it whenever the rendering changes so
+# stanzas cached by earlier versions are no longer used:
+STANZA_FORMAT_VERSION = 1
+
+# The checksums for which by-hash copies of the indices are published if by_hash is set:
+BY_HASH_CHECKSUM_TYPES = ["sha256", "sha512"]
+
+# The number of previous versions of the indices, that are kept in the by-hash directories:
+BY_HASH_HISTORY = 3
+
 
 def publish_verbatim(repository_version_pk):
     """
@@ -64,7 +91,14 @@ def publish_verbatim(repository_version_pk):
     log.info(_("Publication (verbatim): {publication} created").format(publication=publication.pk))
 
 
-def publish(repository_version_pk, simple=False, structured=False, signing_service_pk=None):
+def publish(
+    repository_version_pk,
+    simple=False,
+    structured=False,
+    signing_service_pk=None,
+    compressors="gz",
+    by_hash=False,
+):
     """
     Use provided publisher to create a Publication based on a RepositoryVersion.
 
@@ -73,6 +107,8 @@ def publish(repository_version_pk, simple=False, structured=False, signing_servi
         simple (bool): Create a simple publication with all packages contained in default/all.
         structured (bool): Create a structured publication with releases and components.
         signing_service_pk (str): Use this SigningService to sign the Release files.
+        compressors (str): Whitespace separated list of compressors for the Packages indices.
+        by_hash (bool): Additionally publish the indices in by-hash directories.
 
     """
     if "md5" not in settings.ALLOWED_CONTENT_CHECKSUMS and settings.FORBIDDEN_CHECKSUM_WARNINGS:
@@ -99,16 +135,36 @@ def publish(repository_version_pk, simple=False, structured=False, signing_servi
             publication.simple = simple
             publication.structured = structured
             publication.signing_service = signing_service
+            publication.compressors = compressors
+            publication.by_hash = by_hash
             repository = repo_version.repository
+            previous_publication = _previous_publication(publication)
+            if previous_publication:
+                log.info(
+                    _("Reusing unchanged Packages indices from publication {publication}").format(
+                        publication=previous_publication.pk
+                    )
+                )
+                changed_content = _changed_content(
+                    repo_version, previous_publication.repository_version
+                )
+            pool_paths = _PoolPaths()
+            stanza_cache = None
+            if settings.PUBLISH_STANZA_CACHE_SIZE > 0:
+                stanza_cache = _StanzaCache(settings.PUBLISH_STANZA_CACHE_SIZE)
+            release_helpers = []
+            # (_ComponentHelper or _ReleaseHelper, package queryset) for each set of Packages
+            # indices to be written:
+            index_packages = []
 
             if simple:
                 codename = "default"
                 distribution = "default"
                 component = "all"
+                # The architectures are needed up front, to decide which indices can be reused
                 architectures = (
-                    Package.objects.filter(
-                        pk__in=repo_version.content.order_by("-pulp_created"),
-                    )
+                    Package.objects.filter(pk__in=repo_version.content)
+                    .order_by("architecture")
                     .distinct("architecture")
                     .values_list("architecture", flat=True)
                 )
@@ -124,13 +180,25 @@ def publish(repository_version_pk, simple=False, structured=False, signing_servi
                     description=repository.description,
                     label=repository.name,
                     version=str(repo_version.number),
+                    pool_paths=pool_paths,
+                    stanza_cache=stanza_cache,
+                    previous_publication=previous_publication,
                 )
 
-                for package in Package.objects.filter(
-                    pk__in=repo_version.content.order_by("-pulp_created"),
-                ):
-                    release_helper.components[component].add_package(package)
-                release_helper.finish()
+                packages = Package822Serializer.annotate_artifacts(
+                    Package.objects.filter(pk__in=repo_version.content)
+                )
+                if previous_publication:
+                    changed_architectures = set(
+                        Package.objects.filter(pk__in=changed_content).values_list(
+                            "architecture", flat=True
+                        )
+                    )
+                    release_helper.components[component].reuse_package_indices(
+                        previous_publication, changed_architectures
+                    )
+                release_helpers.append(release_helper)
+                index_packages.append((release_helper.components[component], packages))
 
             if structured:
                 for release in Release.objects.filter(
@@ -157,72 +225,446 @@ def publish(repository_version_pk, simple=False, structured=False, signing_servi
                         label=repository.name,
                         version=str(repo_version.number),
                         suite=release.suite,
+                        pool_paths=pool_paths,
+                        stanza_cache=stanza_cache,
+                        previous_publication=previous_publication,
                     )
 
-                    for prc in PackageReleaseComponent.objects.filter(
-                        pk__in=repo_version.content.order_by("-pulp_created"),
-                        release_component__in=components,
-                    ):
-                        try:
-                            release_helper.components[prc.release_component.component].add_package(
-                                prc.package
+                    # All packages of the release, with their component, in a single query
+                    packages = Package822Serializer.annotate_artifacts(
+                        Package.objects.filter(
+                            deb_packagereleasecomponent__pk__in=repo_version.content,
+                            deb_packagereleasecomponent__release_component__in=components,
+                        ).annotate(
+                            component=F("deb_packagereleasecomponent__release_component__component")
+                        )
+                    )
+                    for release_component in components:
+                        component_helper = release_helper.components[release_component.component]
+                        if previous_publication:
+                            changed_architectures = set(
+                                PackageReleaseComponent.objects.filter(
+                                    pk__in=changed_content, release_component=release_component
+                                ).values_list("package__architecture", flat=True)
+                            )
+                            component_helper.reuse_package_indices(
+                                previous_publication, changed_architectures
                             )
-                        except IntegrityError:
-                            continue
-                    release_helper.finish()
+                    release_helpers.append(release_helper)
+                    index_packages.append((release_helper, packages))
+
+            _write_indices(index_packages)
+            for release_helper in release_helpers:
+                release_helper.finish()
+            if stanza_cache:
+                stanza_cache.evict()
 
     log.info(_("Publication: {publication} created").format(publication=publication.pk))
 
 
+def _previous_publication(publication):
+    """
+    Find the latest complete AptPublication of the same repository using the same options.
+
+    Args:
+        publication (AptPublication): The publication that is being created.
+
+    Returns:
+        AptPublication: The previous publication or None.
+
+    """
+    return (
+        AptPublication.objects.filter(
+            repository_version__repository=publication.repository_version.repository,
+            complete=True,
+            simple=publication.simple,
+            structured=publication.structured,
+            signing_service=publication.signing_service,
+            compressors=publication.compressors,
+            by_hash=publication.by_hash,
+        )
+        .order_by("-pulp_created")
+        .first()
+    )
+
+
+def _changed_content(repo_version, previous_version):
+    """
+    Return a query for the pks of the content added or removed relative to previous_version.
+    """
+    added = repo_version.content.exclude(pk__in=previous_version.content)
+    removed = previous_version.content.exclude(pk__in=repo_version.content)
+    return Content.objects.filter(Q(pk__in=added) | Q(pk__in=removed)).values("pk")
+
+
+def _copy_published_metadata(source_metadata, publication, relative_path=None):
+    """
+    Create a PublishedMetadata for publication, using the artifact of source_metadata.
+
+    Args:
+        source_metadata (PublishedMetadata): The metadata to copy.
+        publication (Publication): The publication the copy belongs to.
+        relative_path (str): The relative path of the copy, defaults to that of source_metadata.
+
+    """
+    with transaction.atomic():
+        metadata = PublishedMetadata(
+            relative_path=relative_path or source_metadata.relative_path, publication=publication
+        )
+        metadata.save()
+        ContentArtifact(
+            artifact=source_metadata._artifacts.get(),
+            content=metadata,
+            relative_path=metadata.relative_path,
+        ).save()
+    return metadata
+
+
+def _write_indices(index_packages):
+    """
+    Write the Packages indices of all components or releases, using a pool of worker processes.
+
+    Every Packages index, one per component and architecture, is rendered, compressed and written
+    by a worker, while the calling process streams the packages from the database, creates their
+    PublishedArtifacts and looks up their cached stanzas. The number of workers is configured
+    using the PUBLISH_WORKERS setting. The PublishedMetadata for the written files is created
+    afterwards by the calling process.
+
+    Args:
+        index_packages (list): Tuples of a _ComponentHelper or _ReleaseHelper and the queryset
+            of its packages.
+
+    """
+    workers = settings.PUBLISH_WORKERS
+    if workers <= 1:
+        executor = _InlineExecutor()
+    else:
+        log.info(_("Writing Packages indices using {workers} workers").format(workers=workers))
+        executor = ProcessPoolExecutor(max_workers=workers)
+    with executor:
+        for helper, packages in index_packages:
+            helper.write(packages, executor)
+
+
+class _InlineExecutor:
+    """
+    An executor, that runs the submitted calls in the calling process right away.
+    """
+
+    def submit(self, fn, *args):
+        future = Future()
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _write_package_index(package_index_path, compressors, component, packages_path, stanzas_path):
+    """
+    Write a Packages index and its compressed variants from spooled packages.
+
+    This runs in a worker process, so it must not access the database. The packages are annotated
+    using Package822Serializer.annotate_artifacts, so they are rendered without any queries.
+
+    Args:
+        package_index_path (str): The path of the uncompressed Packages index.
+        compressors (dict): The compression levels keyed by the compressors of the variants.
+        component (str): The component the packages are published in.
+        packages_path (str): A file of pickled packages, removed once it has been read.
+        stanzas_path (str): If provided, the package pk, the checksums and the stanza of every
+            package, that had no cached stanza, are pickled to this file.
+
+    Returns:
+        list: The paths of the Packages index and all of its compressed variants.
+
+    """
+    package_index_file = _PackageIndexWriter(package_index_path, compressors)
+    stanzas_file = open(stanzas_path, "wb") if stanzas_path else None
+    try:
+        with open(packages_path, "rb") as packages_file:
+            for package in _unpickle_all(packages_file):
+                paragraph = getattr(package, "cached_stanza", None)
+                if paragraph is None:
+                    paragraph = Package822Serializer.model_to822(package, component).dump()
+                    if stanzas_file:
+                        pickle.dump((package.pk, package.stanza_checksums, paragraph), stanzas_file)
+                package_index_file.write(paragraph.encode("utf-8") + b"\n")
+    finally:
+        package_index_file.close()
+        if stanzas_file:
+            stanzas_file.close()
+        os.remove(packages_path)
+    return package_index_file.paths
+
+
+def _unpickle_all(file):
+    """
+    Yield the objects pickled to a file one after another.
+    """
+    while True:
+        try:
+            yield pickle.load(file)
+        except EOFError:
+            return
+
+
+class _PoolPaths:
+    """
+    The pool paths of the packages of a publication, shared by the helpers of all its releases.
+
+    A package may be contained in the same component of several releases, in which case it has
+    the same pool path in all of them, but only one PublishedArtifact may be created for it.
+    """
+
+    def __init__(self):
+        self._paths = set()
+
+    def add(self, path):
+        """
+        Add a pool path, return True if it was not contained yet.
+        """
+        if path in self._paths:
+            return False
+        self._paths.add(path)
+        return True
+
+
+class _StanzaCache:
+    """
+    Reuse the Packages stanzas rendered by previous publications, stored as PackageStanza.
+
+    Stanzas are content addressed: They are keyed by the package, the component, a digest of the
+    checksums of the package's artifact and STANZA_FORMAT_VERSION, so they never need to be
+    invalidated. Using a stanza updates its pulp_last_updated timestamp, and when the cache holds
+    more than size stanzas, the least recently used ones are evicted.
+    """
+
+    def __init__(self, size):
+        self.size = size
+
+    @staticmethod
+    def checksums(package):
+        """
+        Return the digest of the checksums of a package annotated using annotate_artifacts.
+        """
+        checksums = "{} {} {}".format(
+            package.artifact_md5, package.artifact_sha1, package.artifact_sha256
+        )
+        return hashlib.sha256(checksums.encode("utf-8")).hexdigest()
+
+    def lookup(self, packages, component):
+        """
+        Set the cached_stanza of streamed packages, None if it is not cached.
+
+        The stanzas are looked up, and the ones used are touched, using one query each per batch of
+        packages.
+        """
+        packages = iter(packages)
+        while True:
+            batch = list(islice(packages, STANZA_CACHE_BATCH_SIZE))
+            if not batch:
+                return
+            stanzas = PackageStanza.objects.filter(
+                package_id__in=[package.pk for package in batch],
+                component=component,
+                format_version=STANZA_FORMAT_VERSION,
+            ).values_list("pk", "package_id", "checksums", "stanza")
+            stanzas = {
+                (package_id, checksums): (pk, stanza)
+                for pk, package_id, checksums, stanza in stanzas
+            }
+            used = []
+            for package in batch:
+                package.stanza_checksums = self.checksums(package)
+                pk, package.cached_stanza = stanzas.get(
+                    (package.pk, package.stanza_checksums), (None, None)
+                )
+                if pk is not None:
+                    used.append(pk)
+            if used:
+                PackageStanza.objects.filter(pk__in=used).update(
+                    pulp_last_updated=datetime.now(tz=timezone.utc)
+                )
+            yield from batch
+
+    def store(self, stanzas):
+        """
+        Store newly rendered PackageStanzas.
+        """
+        # Concurrent publications may render and store the same stanzas
+        PackageStanza.objects.bulk_create(stanzas, ignore_conflicts=True)
+
+    def evict(self):
+        """
+        Delete the least recently used stanzas exceeding the size of the cache.
+        """
+        cutoff = list(
+            PackageStanza.objects.order_by("-pulp_last_updated").values_list(
+                "pulp_last_updated", flat=True
+            )[self.size : self.size + 1]
+        )
+        if cutoff:
+            PackageStanza.objects.filter(pulp_last_updated__lte=cutoff[0]).delete()
+
+
 class _ComponentHelper:
     def __init__(self, parent, component):
         self.parent = parent
         self.component = component
         self.plain_component = os.path.basename(component)
+        self.package_index_paths = {}
         self.package_index_files = {}
+        # Maps architectures onto the PublishedMetadata reused from a previous publication:
+        self.reused_metadata = {}
 
         for architecture in self.parent.architectures:
-            package_index_path = os.path.join(
+            self.package_index_paths[architecture] = os.path.join(
                 "dists",
                 self.parent.distribution.strip("/"),
                 self.plain_component,
                 "binary-{}".format(architecture),
                 "Packages",
             )
-            os.makedirs(os.path.dirname(package_index_path), exist_ok=True)
-            self.package_index_files[architecture] = (
-                open(package_index_path, "wb"),
-                package_index_path,
+        self.published_artifacts = []
+        # Maps architectures onto the files of the stanzas rendered for their Packages indices:
+        self.rendered_stanzas = {}
+
+    def reuse_package_indices(self, previous_publication, changed_architectures):
+        """
+        Reuse the Packages indices of all unchanged architectures from a previous publication.
+
+        Args:
+            previous_publication (AptPublication): Publication with the same options, for which
+                the packages of this component only differ in changed_architectures.
+            changed_architectures (set): Architectures of the packages that were added or removed.
+
+        """
+        for architecture, package_index_path in self.package_index_paths.items():
+            if architecture in changed_architectures:
+                continue
+            paths = _PackageIndexWriter.variant_paths(package_index_path, self.parent.compressors)
+            previous_metadata = PublishedMetadata.objects.filter(
+                publication=previous_publication, relative_path__in=paths
             )
+            previous_metadata = {metadata.relative_path: metadata for metadata in previous_metadata}
+            if len(previous_metadata) == len(paths):
+                self.reused_metadata[architecture] = [previous_metadata[path] for path in paths]
+
+    def write(self, packages, executor):
+        # The packages are streamed ordered by architecture, so only the packages of one Packages
+        # index are spooled at a time.
+        self.write_packages(packages.order_by("architecture").iterator(), executor)
+
+    def write_packages(self, packages, executor):
+        # The packages are expected to be ordered by architecture
+        if self.parent.stanza_cache:
+            packages = self.parent.stanza_cache.lookup(packages, self.component)
+        for architecture, architecture_packages in groupby(
+            packages, key=attrgetter("architecture")
+        ):
+            self._write_package_index(architecture, architecture_packages, executor)
+        self.save_published_artifacts()
+        # Architectures without any packages get empty Packages indices
+        for architecture in self.package_index_paths:
+            if architecture not in self.package_index_files:
+                self._write_package_index(architecture, [], executor)
+
+    def _write_package_index(self, architecture, packages, executor):
+        """
+        Publish the packages of an architecture, and submit the writing of their Packages index.
+        """
+        package_index_path = self.package_index_paths[architecture]
+        packages_file = None
+        if architecture not in self.reused_metadata:
+            os.makedirs(os.path.dirname(package_index_path), exist_ok=True)
+            packages_file = tempfile.NamedTemporaryFile(dir=".", delete=False)
+        for package in packages:
+            self.add_package(package)
+            if packages_file:
+                pickle.dump(package, packages_file)
+        if not packages_file:
+            # The Packages index of this architecture is reused
+            self.package_index_files[architecture] = None
+            return
+        packages_file.close()
+        stanzas_path = None
+        if self.parent.stanza_cache:
+            stanzas_path = packages_file.name + ".stanzas"
+        self.rendered_stanzas[architecture] = stanzas_path
+        self.package_index_files[architecture] = executor.submit(
+            _write_package_index,
+            package_index_path,
+            self.parent.compressors,
+            self.component,
+            packages_file.name,
+            stanzas_path,
+        )
 
     def add_package(self, package):
-        published_artifact = PublishedArtifact(
-            relative_path=package.filename(self.component),
-            publication=self.parent.publication,
-            content_artifact=package.contentartifact_set.get(),
-        )
-        published_artifact.save()
-        package_serializer = Package822Serializer(package, context={"request": None})
-        package_serializer.to822(self.component).dump(
-            self.package_index_files[package.architecture][0]
-        )
-        self.package_index_files[package.architecture][0].write(b"\n")
+        # The package is expected to be annotated using Package822Serializer.annotate_artifacts
+        relative_path = package.filename(self.component)
+        if self.parent.pool_paths.add(relative_path):
+            self.published_artifacts.append(
+                PublishedArtifact(
+                    relative_path=relative_path,
+                    publication=self.parent.publication,
+                    content_artifact_id=package.content_artifact_pk,
+                )
+            )
+            if len(self.published_artifacts) >= PUBLISHED_ARTIFACTS_BATCH_SIZE:
+                self.save_published_artifacts()
+
+    def save_published_artifacts(self):
+        # The pool paths are deduplicated by add_package, so there are no conflicting rows
+        PublishedArtifact.objects.bulk_create(self.published_artifacts)
+        self.published_artifacts = []
+
+    def save_rendered_stanzas(self, stanzas_path):
+        # The stanzas rendered by the worker are stored in batches
+        with open(stanzas_path, "rb") as stanzas_file:
+            stanzas = _unpickle_all(stanzas_file)
+            while True:
+                batch = [
+                    PackageStanza(
+                        package_id=package_pk,
+                        component=self.component,
+                        format_version=STANZA_FORMAT_VERSION,
+                        checksums=checksums,
+                        stanza=stanza,
+                    )
+                    for package_pk, checksums, stanza in islice(stanzas, STANZA_CACHE_BATCH_SIZE)
+                ]
+                if not batch:
+                    break
+                self.parent.stanza_cache.store(batch)
+        os.remove(stanzas_path)
 
     def finish(self):
-        # Publish Packages files
-        for (package_index_file, package_index_path) in self.package_index_files.values():
-            package_index_file.close()
-            gz_package_index_path = _zip_file(package_index_path)
-            package_index = PublishedMetadata.create_from_file(
-                publication=self.parent.publication, file=File(open(package_index_path, "rb"))
-            )
-            package_index.save()
-            gz_package_index = PublishedMetadata.create_from_file(
-                publication=self.parent.publication, file=File(open(gz_package_index_path, "rb"))
-            )
-            gz_package_index.save()
-            self.parent.add_metadata(package_index)
-            self.parent.add_metadata(gz_package_index)
+        # Publish the Packages files written by self.write() or reused from a previous publication
+        for architecture in self.package_index_paths:
+            if architecture in self.reused_metadata:
+                for previous_metadata in self.reused_metadata[architecture]:
+                    package_index = _copy_published_metadata(
+                        previous_metadata, self.parent.publication
+                    )
+                    self.parent.add_metadata(package_index)
+                continue
+            metadata_paths = self.package_index_files[architecture].result()
+            if self.rendered_stanzas[architecture]:
+                self.save_rendered_stanzas(self.rendered_stanzas[architecture])
+            for metadata_path in metadata_paths:
+                package_index = PublishedMetadata.create_from_file(
+                    publication=self.parent.publication, file=File(open(metadata_path, "rb"))
+                )
+                package_index.save()
+                self.parent.add_metadata(package_index)
 
 
 class _ReleaseHelper:
@@ -237,8 +679,16 @@ class _ReleaseHelper:
         version,
         description=None,
         suite=None,
+        pool_paths=None,
+        stanza_cache=None,
+        previous_publication=None,
     ):
         self.publication = publication
+        self.pool_paths = pool_paths or _PoolPaths()
+        self.stanza_cache = stanza_cache
+        self.previous_publication = previous_publication
+        # Maps the by-hash directories onto the digests of the files published in them:
+        self.by_hash_digests = defaultdict(set)
         self.distribution = distribution
         # Note: The order in which fields are added to self.release is retained in the
         # published Release file. As a "nice to have" for human readers, we try to use
@@ -251,6 +701,8 @@ class _ReleaseHelper:
         self.release["Version"] = version
         self.release["Codename"] = codename or distribution.split("/")[0]
         self.release["Date"] = datetime.now(tz=timezone.utc).strftime("%a, %d %b %Y %H:%M:%S %z")
+        if publication.by_hash:
+            self.release["Acquire-By-Hash"] = "yes"
         self.release["Architectures"] = " ".join(architectures)
         self.release["Components"] = ""  # Will be set later
         if description:
@@ -261,9 +713,21 @@ class _ReleaseHelper:
                 self.release[deb_field] = []
 
         self.architectures = architectures
+        self.compressors = AptPublication.parse_compressors(publication.compressors)
         self.components = {component: _ComponentHelper(self, component) for component in components}
         self.signing_service = publication.signing_service
 
+    def write(self, packages, executor):
+        # The packages are expected to be annotated with their component, they are streamed
+        # ordered by component and architecture and handed to the helper of their component.
+        packages = packages.order_by("component", "architecture").iterator()
+        for component, component_packages in groupby(packages, key=attrgetter("component")):
+            self.components[component].write_packages(component_packages, executor)
+        for component_helper in self.components.values():
+            if not component_helper.package_index_files:
+                # A component without any packages gets empty Packages indices
+                component_helper.write_packages([], executor)
+
     def add_metadata(self, metadata):
         artifact = metadata._artifacts.get()
         release_file_folder = os.path.join("dists", self.distribution)
@@ -279,10 +743,49 @@ class _ReleaseHelper:
                     }
                 )
 
+        if self.publication.by_hash:
+            # Clients use the strongest checksum listed in the Release file to locate the indices.
+            for checksum_type in BY_HASH_CHECKSUM_TYPES:
+                if checksum_type in settings.ALLOWED_CONTENT_CHECKSUMS:
+                    by_hash_dir = os.path.join(
+                        os.path.dirname(metadata.relative_path),
+                        "by-hash",
+                        CHECKSUM_TYPE_MAP[checksum_type],
+                    )
+                    digest = getattr(artifact, checksum_type)
+                    self.by_hash_digests[by_hash_dir].add(digest)
+                    _copy_published_metadata(
+                        metadata, self.publication, os.path.join(by_hash_dir, digest)
+                    )
+
+    def add_by_hash_history(self):
+        """
+        Keep the by-hash files of indices published by the previous publication, but not this one.
+
+        Clients that fetched the Release file of the previous publication, may request the indices
+        it lists after this publication has been distributed. The files of up to BY_HASH_HISTORY
+        previous versions of the indices in every by-hash directory are copied.
+        """
+        for by_hash_dir, digests in self.by_hash_digests.items():
+            previous_metadata = (
+                PublishedMetadata.objects.filter(
+                    publication=self.previous_publication,
+                    relative_path__startswith=by_hash_dir + "/",
+                )
+                .exclude(
+                    relative_path__in=[os.path.join(by_hash_dir, digest) for digest in digests]
+                )
+                .order_by("-contentartifact__artifact__pulp_created")
+            )
+            for metadata in previous_metadata[: BY_HASH_HISTORY * len(digests)]:
+                _copy_published_metadata(metadata, self.publication)
+
     def finish(self):
         # Publish Packages files
         for component in self.components.values():
             component.finish()
+        if self.publication.by_hash and self.previous_publication:
+            self.add_by_hash_history()
         # Publish Release file
         self.release["Components"] = " ".join(self.components.keys())
         release_dir = os.path.join("dists", self.distribution.strip("/"))
@@ -308,9 +811,35 @@ class _ReleaseHelper:
                 metadata.save()
 
 
-def _zip_file(file_path):
-    gz_file_path = file_path + ".gz"
-    with open(file_path, "rb") as f_in:
-        with GzipFile(gz_file_path, "wb") as f_out:
-            shutil.copyfileobj(f_in, f_out)
-    return gz_file_path
+_COMPRESSOR_FILES = {
+    "gz": lambda path, level: gzip.GzipFile(path, "wb", compresslevel=level),
+    "bz2": lambda path, level: bz2.BZ2File(path, "wb", compresslevel=level),
+    "xz": lambda path, level: lzma.LZMAFile(path, "wb", preset=level),
+}
+
+
+class _PackageIndexWriter:
+    """
+    Write a Packages index and all of its compressed variants in a single pass.
+    """
+
+    def __init__(self, path, compressors):
+        self.paths = self.variant_paths(path, compressors)
+        self.files = [open(path, "wb")]
+        for compressed_path, (name, level) in zip(self.paths[1:], compressors.items()):
+            self.files.append(_COMPRESSOR_FILES[name](compressed_path, level))
+
+    @staticmethod
+    def variant_paths(path, compressors):
+        """
+        Return the paths of the uncompressed Packages index and all of its compressed variants.
+        """
+        return [path] + ["{}.{}".format(path, name) for name in compressors]
+
+    def write(self, data):
+        for file in self.files:
+            file.write(data)
+
+    def close(self):
+        for file in self.files:
+            file.close()
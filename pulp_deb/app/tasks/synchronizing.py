@@ -1,31 +1,43 @@
 import asyncio
 import aiohttp
 import os
+import re
 import shutil
 import bz2
 import gzip
+import hashlib
+import io
+import itertools
 import lzma
+import pickle
+import time
 import gnupg
 
-from collections import defaultdict
-from tempfile import NamedTemporaryFile
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+from tempfile import NamedTemporaryFile, TemporaryDirectory, TemporaryFile
 from debian import deb822
 from urllib.parse import urlparse, urlunparse
 from django.conf import settings
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError, transaction
 
-from pulpcore.plugin.exceptions import DigestValidationError
+from pulpcore.plugin.exceptions import DigestValidationError, SizeValidationError
 
 from pulpcore.plugin.models import (
     Artifact,
+    Content,
     ProgressReport,
     Remote,
     Repository,
 )
 
 from pulpcore.plugin.stages import (
+    ContentAssociation,
     DeclarativeArtifact,
     DeclarativeContent,
     DeclarativeVersion,
+    EndStage,
     Stage,
     QueryExistingArtifacts,
     ArtifactDownloader,
@@ -34,6 +46,7 @@ from pulpcore.plugin.stages import (
     ContentSaver,
     RemoteArtifactSaver,
     ResolveContentFutures,
+    create_pipeline,
 )
 
 from pulp_deb.app.models import (
@@ -50,14 +63,16 @@ from pulp_deb.app.models import (
     AptRemote,
 )
 
-from pulp_deb.app.serializers import (
-    InstallerPackage822Serializer,
-    Package822Serializer,
-)
+from pulp_deb.app.downloaders import DECOMPRESSORS
+from pulp_deb.app.serializers import Package822Serializer
 
 from pulp_deb.app.constants import (
     NO_MD5_WARNING_MESSAGE,
     CHECKSUM_TYPE_MAP,
+    GPG_KEYRING_CACHE_SIZE,
+    PACKAGE_INDEX_CHUNK_SIZE,
+    PACKAGE_INDEX_VARIANTS,
+    PACKAGE_WINDOW_SIZE,
 )
 
 
@@ -97,7 +112,7 @@ class NoPackageIndexFile(Exception):
     pass
 
 
-def synchronize(remote_pk, repository_pk, mirror):
+def synchronize(remote_pk, repository_pk, mirror, optimize=False):
     """
     Sync content from the remote repository.
 
@@ -107,24 +122,81 @@ def synchronize(remote_pk, repository_pk, mirror):
         remote_pk (str): The remote PK.
         repository_pk (str): The repository PK.
         mirror (bool): True for mirror mode, False for additive.
+        optimize (bool): Skip parsing package indices that are unchanged since the latest
+            repository version, if it was synced from the same remote with the same mirror setting.
 
     Raises:
         ValueError: If the remote does not specify a URL to sync
 
     """
     remote = AptRemote.objects.get(pk=remote_pk)
-    repository = Repository.objects.get(pk=repository_pk)
+    repository = Repository.objects.get(pk=repository_pk).cast()
 
     if not remote.url:
         raise ValueError(_("A remote must have a url specified to synchronize."))
 
-    first_stage = DebFirstStage(remote)
+    base_version = _optimizable_version(repository, remote, mirror)
+    previous_version = base_version if optimize else None
+    first_stage = DebFirstStage(
+        remote, previous_version=previous_version, base_version=base_version
+    )
     DebDeclarativeVersion(first_stage, repository, mirror=mirror).create()
+    _record_sync(repository, remote, mirror)
+
+
+def _optimizable_version(repository, remote, mirror):
+    """
+    Get the latest repository version, if a sync may carry over packages from it.
+
+    The packages of an unchanged package index are carried over from the latest repository
+    version, and so are the packages of a changed one, that the latest repository version already
+    contains. So it must be the result of a sync from the same, unchanged remote, with the same
+    mirror setting. Otherwise it may contain packages, that are no longer in the package index.
+
+    Returns:
+        RepositoryVersion: The latest repository version, or None if it must not be used.
+
+    """
+    latest_version = repository.latest_version()
+    if (
+        repository.last_sync_remote_id != remote.pk
+        or repository.last_sync_mirror != mirror
+        or repository.last_sync_repository_version != latest_version.number
+    ):
+        log.info(
+            _(
+                "The latest repository version is not the result of a sync from this remote "
+                "with the same mirror setting. Not carrying over any content."
+            )
+        )
+        return None
+    if repository.last_sync_remote_updated != remote.pulp_last_updated:
+        log.info(_("The remote was changed since the last sync. Not carrying over any content."))
+        return None
+    return latest_version
+
+
+def _record_sync(repository, remote, mirror):
+    """
+    Remember the remote and mirror setting, that the latest repository version was synced with.
+    """
+    repository.last_sync_remote = remote
+    repository.last_sync_remote_updated = remote.pulp_last_updated
+    repository.last_sync_mirror = mirror
+    repository.last_sync_repository_version = repository.latest_version().number
+    repository.save(
+        update_fields=[
+            "last_sync_remote",
+            "last_sync_remote_updated",
+            "last_sync_mirror",
+            "last_sync_repository_version",
+        ]
+    )
 
 
 class DeclarativeFailsafeArtifact(DeclarativeArtifact):
     """
-    A declarative artifact that does not fail on 404.
+    A declarative artifact that does not fail on 404, or if it does not match its checksums.
     """
 
     async def download(self):
@@ -132,7 +204,7 @@ class DeclarativeFailsafeArtifact(DeclarativeArtifact):
         Download the artifact and set to None on 404.
         """
         try:
-            await super().download()
+            await self._download()
         except aiohttp.client_exceptions.ClientResponseError as e:
             if e.code == 404:
                 self.artifact = None
@@ -143,7 +215,7 @@ class DeclarativeFailsafeArtifact(DeclarativeArtifact):
                 )
             else:
                 raise
-        except DigestValidationError:
+        except (DigestValidationError, SizeValidationError):
             self.artifact = None
             log.info(
                 _("Digest for artifact with relative_path='{}' not matched. Ignored").format(
@@ -151,12 +223,187 @@ class DeclarativeFailsafeArtifact(DeclarativeArtifact):
                 )
             )
 
+    async def _download(self):
+        await super().download()
+
+
+class DeclarativePackageIndexArtifact(DeclarativeFailsafeArtifact):
+    """
+    A failsafe declarative artifact for a compressed package index.
+
+    The package index is decompressed and hashed while it is downloaded, so the uncompressed
+    artifact is available as `uncompressed_artifact` once the download has finished. The
+    uncompressed data can be read from `stream` while it is downloaded.
+    """
+
+    def __init__(self, *args, uncompressed_sha256, **kwargs):
+        """
+        A failsafe declarative artifact for a compressed package index.
+
+        Args:
+            uncompressed_sha256 (str): The expected sha256 of the uncompressed package index, or
+                None if the Release file does not list it.
+
+        """
+        super().__init__(*args, **kwargs)
+        self.uncompressed_sha256 = uncompressed_sha256
+        self.uncompressed_artifact = None
+        self.stream = PackageIndexStream()
+
+    async def _download(self):
+        expected_digests = {}
+        for digest_name in self.artifact.DIGEST_FIELDS:
+            digest_value = getattr(self.artifact, digest_name)
+            if digest_value:
+                expected_digests[digest_name] = digest_value
+        downloader = self.remote.get_downloader(
+            url=self.url,
+            expected_digests=expected_digests or None,
+            expected_size=self.artifact.size or None,
+            decompress=True,
+            expected_uncompressed_digests=(
+                {"sha256": self.uncompressed_sha256} if self.uncompressed_sha256 else None
+            ),
+            uncompressed_stream=self.stream,
+        )
+        try:
+            download_result = await downloader.run()
+        except Exception as e:
+            self.stream.finish(error=e)
+            raise
+        self.stream.finish()
+        self.artifact = Artifact(**download_result.artifact_attributes, file=download_result.path)
+        self.uncompressed_artifact = Artifact(
+            **downloader.uncompressed_artifact_attributes, file=downloader.uncompressed_path
+        )
+
+
+class PackageIndexStream:
+    """
+    The uncompressed data of a package index, that is read while the package index is downloaded.
+
+    The decompressing downloader reports how much of the uncompressed file it has written, and
+    readers follow the file on disk, so the data is not held in memory. A stream is finished once
+    the download has finished, failed, or was not needed at all.
+    """
+
+    def __init__(self):
+        self.path = None
+        self.size = 0
+        self.started = False
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Event()
+
+    def start(self, path):
+        """
+        Signal that the uncompressed data is written to the file at path.
+        """
+        self.path = path
+        self.started = True
+        self._changed.set()
+
+    def grow(self, size):
+        """
+        Signal that size bytes of uncompressed data have been written and flushed.
+        """
+        self.size = size
+        self._changed.set()
+
+    def finish(self, error=None):
+        """
+        Signal that no more data is written, either because of an error or because all of the
+        data was written and validated. Finishing a finished stream has no effect.
+        """
+        if not self.done:
+            self.done = True
+            self.error = error
+            self._changed.set()
+
+    async def _wait(self):
+        self._changed.clear()
+        await self._changed.wait()
+
+    async def wait_started(self):
+        """
+        Wait until the download has started writing data, or has finished without doing so.
+
+        Returns:
+            bool: True if the data can be read from this stream.
+
+        """
+        while not self.started and not self.done:
+            await self._wait()
+        return self.started
+
+    async def chunks(self, size=PACKAGE_INDEX_CHUNK_SIZE):
+        """
+        Read the uncompressed data in chunks of whole paragraphs, while it is downloaded.
+
+        This must only be used once wait_started returned True.
+
+        Args:
+            size (int): The number of bytes to read at a time. Unless the download has finished,
+                this waits until as many bytes are available.
+
+        Yields:
+            bytes: Chunks of the Packages file, like the _package_index_chunks function.
+
+        Raises:
+            Exception: The error the download failed with. The last paragraph is not yielded
+                in this case, because it may be incomplete.
+
+        """
+        rest = b""
+        with open(self.path, "rb") as uncompressed_file:
+            while True:
+                if self.size - uncompressed_file.tell() < size and not self.done:
+                    await self._wait()
+                    continue
+                if self.error:
+                    raise self.error
+                data = uncompressed_file.read(size)
+                if not data:
+                    break
+                chunk, rest = _split_package_index_data(rest + data)
+                if chunk:
+                    yield chunk
+        if rest:
+            yield rest
+
 
 class DebDeclarativeVersion(DeclarativeVersion):
     """
     This class creates the Pipeline.
     """
 
+    def create(self):
+        """
+        Perform the work and report statistics about every stage of the pipeline.
+
+        Like DeclarativeVersion.create, but the content is associated by the DebContentAssociation
+        stage, which keeps the content carried over by the first stage.
+
+        Returns: The created RepositoryVersion or None if it represents no change from the latest.
+        """
+        with TemporaryDirectory(dir="."):
+            with self.repository.new_version() as new_version:
+                loop = asyncio.get_event_loop()
+                stages = self.pipeline_stages(new_version)
+                stages.append(
+                    DebContentAssociation(
+                        new_version, self.mirror, carried_over=self.first_stage.carried_over
+                    )
+                )
+                stages.append(EndStage())
+                pipeline = create_pipeline(stages)
+                loop.run_until_complete(pipeline)
+        for statistics in self.stage_statistics:
+            log.info(str(statistics))
+            with ProgressReport(message=str(statistics), code="sync.stage_statistics") as pb:
+                pb.done = statistics.items
+        return new_version if new_version.complete else None
+
     def pipeline_stages(self, new_version):
         """
         Build the list of pipeline stages feeding into the ContentAssociation stage.
@@ -182,9 +429,236 @@ class DebDeclarativeVersion(DeclarativeVersion):
             RemoteArtifactSaver(),
             ResolveContentFutures(),
         ]
+        start = time.perf_counter()
+        self.stage_statistics = [_measure_stage(stage, start) for stage in pipeline]
         return pipeline
 
 
+class DebContentAssociation(ContentAssociation):
+    """
+    A ContentAssociation stage, that also associates the content carried over by the first stage.
+
+    Unchanged packages and package indices of the latest repository version, as well as package
+    release components, are not passed through the pipeline. Those contained in the new version
+    already only need to be kept when syncing in mirror mode, the others are added once the first
+    stage has finished.
+    """
+
+    def __init__(self, new_version, mirror, *args, carried_over=(), **kwargs):
+        """
+        A ContentAssociation stage, that also associates the content carried over.
+
+        Args:
+            new_version (:class:`~pulpcore.plugin.models.RepositoryVersion`): The repo version this
+                stage associates content with.
+            mirror (bool): Whether content not in the stream should be removed from the repository.
+            carried_over (set): The primary keys of the content to associate or keep. Complete once
+                the first stage has finished.
+
+        """
+        super().__init__(new_version, mirror, *args, **kwargs)
+        self.carried_over = carried_over
+
+    async def run(self):
+        """
+        Associate the received and the carried over content with the new version, and remove the
+        rest in mirror mode.
+        """
+        with ProgressReport(message="Associating Content", code="associating.content") as pb:
+            present = set(self.new_version.content.values_list("pk", flat=True))
+            to_delete = set(present)
+            async for batch in self.batches():
+                to_add = set()
+                for d_content in batch:
+                    try:
+                        to_delete.remove(d_content.content.pk)
+                    except KeyError:
+                        to_add.add(d_content.content.pk)
+                        await self.put(d_content)
+
+                if to_add:
+                    self.new_version.add_content(Content.objects.filter(pk__in=to_add))
+                    present.update(to_add)
+                    pb.increase_by(len(to_add))
+
+            # The first stage has finished, so all carried over content is known
+            to_add = self.carried_over - present
+            if to_add:
+                self.new_version.add_content(Content.objects.filter(pk__in=to_add))
+                pb.increase_by(len(to_add))
+
+            if self.allow_delete:
+                to_delete.difference_update(self.carried_over)
+                with ProgressReport(
+                    message="Un-Associating Content", code="unassociating.content"
+                ) as pb:
+                    if to_delete:
+                        self.new_version.remove_content(Content.objects.filter(pk__in=to_delete))
+                        pb.increase_by(len(to_delete))
+
+
+class StageStatistics:
+    """
+    Statistics about the items put out by a pipeline stage and the time spent waiting by it.
+
+    The time between the start of the pipeline and the last activity of the stage is divided into
+    waiting for output, while an item is being put into the next stage, waiting for input, while
+    the stage is waiting for the next item or batch of its input, and being busy. Stages that fetch
+    their input concurrently to their work, like the ArtifactDownloader, count that work as waiting
+    for input. The times are taken from clock, which defaults to time.perf_counter.
+    """
+
+    def __init__(self, name, start, clock=time.perf_counter):
+        self.name = name
+        self.clock = clock
+        self.items = 0
+        self.packages = 0
+        self.input_blocked = 0.0
+        self.output_blocked = 0.0
+        self.start = start
+        self.end = start
+        self._waiting_for_input = 0
+        self._waiting_for_output = 0
+
+    def _update(self, waiting_for_input=0, waiting_for_output=0):
+        now = self.clock()
+        if self._waiting_for_output:
+            self.output_blocked += now - self.end
+        elif self._waiting_for_input:
+            self.input_blocked += now - self.end
+        self.end = now
+        self._waiting_for_input += waiting_for_input
+        self._waiting_for_output += waiting_for_output
+
+    @property
+    def duration(self):
+        """
+        The time from the start of the pipeline until the last activity of the stage.
+        """
+        return self.end - self.start
+
+    @property
+    def busy(self):
+        """
+        The time the stage spent working, rather than waiting for its input or output.
+        """
+        return self.duration - self.input_blocked - self.output_blocked
+
+    def __str__(self):
+        duration = self.duration
+        return _(
+            "Stage {name}: {items} items ({rate:.0f}/s), {packages} packages, busy {busy:.1f}s, "
+            "waiting for input {input_blocked:.1f}s, waiting for output {output_blocked:.1f}s"
+        ).format(
+            name=self.name,
+            items=self.items,
+            rate=self.items / duration if duration else 0,
+            packages=self.packages,
+            busy=self.busy,
+            input_blocked=self.input_blocked,
+            output_blocked=self.output_blocked,
+        )
+
+
+def _measure_stage(stage, start, clock=time.perf_counter):
+    """
+    Wrap the items(), batches() and put() methods of a stage to collect its StageStatistics.
+
+    Args:
+        stage (:class:`~pulpcore.plugin.stages.Stage`): The stage to measure.
+        start (float): The time the pipeline is started at, as returned by clock().
+        clock (callable): Returns the current time in seconds.
+
+    Returns:
+        StageStatistics: The statistics, that are updated while the pipeline runs.
+
+    """
+    statistics = StageStatistics(type(stage).__name__, start, clock)
+    items, batches, put = stage.items, stage.batches, stage.put
+
+    async def measure_input(iterator):
+        while True:
+            statistics._update(waiting_for_input=1)
+            try:
+                item = await iterator.__anext__()
+            except StopAsyncIteration:
+                return
+            finally:
+                statistics._update(waiting_for_input=-1)
+            yield item
+
+    def measured_items():
+        return measure_input(items())
+
+    def measured_batches(*args, **kwargs):
+        return measure_input(batches(*args, **kwargs))
+
+    async def measured_put(item):
+        statistics._update(waiting_for_output=1)
+        try:
+            await put(item)
+        finally:
+            statistics._update(waiting_for_output=-1)
+        statistics.items += 1
+        if isinstance(item.content, Package):
+            statistics.packages += 1
+
+    stage.items = measured_items
+    stage.batches = measured_batches
+    stage.put = measured_put
+    return statistics
+
+
+def _get_or_create_package_release_components(packages, release_component):
+    """
+    Get or create the PackageReleaseComponents of saved packages in bulk.
+
+    The existing PackageReleaseComponents are looked up using a single query, and only the missing
+    ones are saved in a single transaction. Each one is saved in its own savepoint, so one that was
+    created concurrently in the meantime is fetched instead, like the ContentSaver stage does. The
+    returned units are saved already, so they can be associated with a repository version by
+    primary key.
+
+    Args:
+        packages (list): Saved packages contained in the release component.
+        release_component (ReleaseComponent): The saved release component.
+
+    Returns:
+        list: The PackageReleaseComponents of all packages.
+
+    """
+    packages = {package.pk: package for package in packages}
+    package_release_components = list(
+        PackageReleaseComponent.objects.filter(
+            release_component=release_component, package_id__in=packages.keys()
+        )
+    )
+    existing = {
+        package_release_component.package_id
+        for package_release_component in package_release_components
+    }
+    missing = [
+        PackageReleaseComponent(package=package, release_component=release_component)
+        for pk, package in packages.items()
+        if pk not in existing
+    ]
+    with transaction.atomic():
+        for package_release_component in missing:
+            try:
+                with transaction.atomic():
+                    package_release_component.save()
+            except IntegrityError as e:
+                try:
+                    package_release_component = PackageReleaseComponent.objects.get(
+                        package=package_release_component.package,
+                        release_component=release_component,
+                    )
+                except ObjectDoesNotExist:
+                    raise e
+            package_release_components.append(package_release_component)
+    return package_release_components
+
+
 def _filter_split_architectures(release_file_string, remote_string, distribution):
     """
     Returns the set intersection of the two architectures strings provided as a sorted list. If the
@@ -254,13 +728,24 @@ class DebUpdateReleaseFileAttributes(Stage):
         self.remote = remote
         self.gpgkey = remote.gpgkey
         if self.gpgkey:
-            gnupghome = os.path.join(os.getcwd(), "gpg-home")
-            os.makedirs(gnupghome)
-            self.gpg = gnupg.GPG(gpgbinary="/usr/bin/gpg", gnupghome=gnupghome)
-            import_res = self.gpg.import_keys(self.gpgkey)
-            if import_res.count == 0:
-                log.warning(_("Key import failed."))
-            pass
+            self.gpg = _get_keyring(self.gpgkey)
+
+    def _verify_detached(self, release_artifact, signature_artifact):
+        """
+        Verify a detached signature, passing the Release data to gpg on stdin.
+
+        If the signature is stored on the local filesystem, gpg reads it in place. Otherwise it
+        is written to a temporary file first.
+        """
+        data = release_artifact.file.read()
+        try:
+            return self.gpg.verify_data(signature_artifact.file.path, data)
+        except NotImplementedError:
+            # The storage backend does not provide local file paths
+            with NamedTemporaryFile() as signature_file:
+                signature_file.write(signature_artifact.file.read())
+                signature_file.flush()
+                return self.gpg.verify_data(signature_file.name, data)
 
     async def run(self):
         """
@@ -278,12 +763,9 @@ class DebUpdateReleaseFileAttributes(Stage):
                     if "Release" in da_names:
                         if "Release.gpg" in da_names:
                             if self.gpgkey:
-                                with NamedTemporaryFile() as tmp_file:
-                                    tmp_file.write(da_names["Release"].artifact.file.read())
-                                    tmp_file.flush()
-                                    verified = self.gpg.verify_file(
-                                        da_names["Release.gpg"].artifact.file, tmp_file.name
-                                    )
+                                verified = self._verify_detached(
+                                    da_names["Release"].artifact, da_names["Release.gpg"].artifact
+                                )
                                 if verified.valid:
                                     log.info(_("Verification of Release successful."))
                                     release_file_artifact = da_names["Release"].artifact
@@ -339,6 +821,84 @@ class DebUpdateReleaseFileAttributes(Stage):
                 await self.put(d_content)
 
 
+def _get_keyring(gpgkey):
+    """
+    Get a GPG instance using a keyring that contains the given key material.
+
+    Keyrings are cached in the working directory, keyed by the sha256 of their key material, so
+    the keys of a remote are only imported on its first sync, instead of on every sync. At most
+    GPG_KEYRING_CACHE_SIZE keyrings are kept, the least recently used ones are removed.
+
+    Args:
+        gpgkey (str): The key material of a remote.
+
+    Returns:
+        gnupg.GPG: A GPG instance using the cached keyring.
+
+    """
+    keyrings_dir = os.path.join(settings.WORKING_DIRECTORY, "deb-gpg-keyrings")
+    gnupghome = os.path.join(keyrings_dir, hashlib.sha256(gpgkey.encode()).hexdigest())
+    if os.path.isdir(gnupghome):
+        # Mark the keyring as recently used, so it is evicted last.
+        try:
+            os.utime(gnupghome)
+        except OSError:
+            pass
+        return gnupg.GPG(gpgbinary="/usr/bin/gpg", gnupghome=gnupghome)
+
+    # Import the keys in the task working directory, and move the keyring into place in one step,
+    # so concurrent syncs never use an incomplete keyring.
+    new_gnupghome = os.path.join(os.getcwd(), "gpg-home")
+    os.makedirs(new_gnupghome, exist_ok=True)
+    gpg = gnupg.GPG(gpgbinary="/usr/bin/gpg", gnupghome=new_gnupghome)
+    import_res = gpg.import_keys(gpgkey)
+    if import_res.count == 0:
+        log.warning(_("Key import failed."))
+        return gpg
+    try:
+        os.makedirs(keyrings_dir, exist_ok=True)
+        os.rename(new_gnupghome, gnupghome)
+    except OSError:
+        # Either another sync cached the same key material in the meantime, or the keyrings can
+        # not be moved there. The new keyring is removed together with the working directory.
+        if not os.path.isdir(gnupghome):
+            return gpg
+    else:
+        _evict_keyrings(keyrings_dir)
+    return gnupg.GPG(gpgbinary="/usr/bin/gpg", gnupghome=gnupghome)
+
+
+def _evict_keyrings(keyrings_dir):
+    """
+    Remove the least recently used keyrings, if more than GPG_KEYRING_CACHE_SIZE are cached.
+
+    Keyrings are renamed before they are removed, so concurrent syncs either find a complete
+    keyring, or build a new one.
+
+    Args:
+        keyrings_dir (str): The directory containing the cached keyrings.
+
+    """
+    keyrings = []
+    with os.scandir(keyrings_dir) as entries:
+        for entry in entries:
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            try:
+                keyrings.append((entry.stat().st_mtime, entry.name))
+            except OSError:
+                # The keyring was evicted by a concurrent sync
+                continue
+    keyrings.sort(reverse=True)
+    for _mtime, name in keyrings[GPG_KEYRING_CACHE_SIZE:]:
+        evicted = os.path.join(keyrings_dir, ".evicted-{}-{}".format(name, os.getpid()))
+        try:
+            os.rename(os.path.join(keyrings_dir, name), evicted)
+        except OSError:
+            continue
+        shutil.rmtree(evicted, ignore_errors=True)
+
+
 class DebUpdatePackageIndexAttributes(Stage):  # TODO: Needs a new name
     """
     This stage handles PackageIndex content.
@@ -353,32 +913,76 @@ class DebUpdatePackageIndexAttributes(Stage):  # TODO: Needs a new name
         with ProgressReport(message="Update PackageIndex units", code="update.packageindex") as pb:
             async for d_content in self.items():
                 if isinstance(d_content.content, PackageIndex):
-                    if not d_content.d_artifacts:
+                    for da in d_content.d_artifacts:
+                        if isinstance(da, DeclarativePackageIndexArtifact):
+                            # Not downloaded, if the artifact exists already
+                            da.stream.finish()
+                    if not [
+                        da
+                        for da in d_content.d_artifacts
+                        if os.path.basename(da.relative_path).startswith("Packages")
+                        and not da.deferred_download
+                    ]:
+                        # Not one variant of the package index could be downloaded
                         d_content.content = None
                         d_content.resolve()
                         continue
-                    content = d_content.content
-                    if not [
-                        da for da in d_content.d_artifacts if da.artifact.sha256 == content.sha256
-                    ]:
-                        # No main_artifact found, uncompress one
-                        relative_dir = os.path.dirname(d_content.content.relative_path)
-                        filename = _uncompress_artifact(d_content.d_artifacts, relative_dir)
-                        da = DeclarativeArtifact(
-                            Artifact.init_and_validate(
-                                filename, expected_digests={"sha256": content.sha256}
-                            ),
-                            filename,
-                            content.relative_path,
-                            d_content.d_artifacts[0].remote,
-                        )
-                        d_content.d_artifacts.append(da)
-                        da.artifact.save()
-
+                    _add_uncompressed_artifact(d_content)
                     pb.increment()
                 await self.put(d_content)
 
 
+def _add_uncompressed_artifact(d_content):
+    """
+    Ensure, that the uncompressed artifact of a PackageIndex is available.
+
+    If the Release file does not list the uncompressed package index, the sha256 of the
+    PackageIndex is set to the one of the uncompressed artifact. Variants with a deferred download
+    are not taken into account.
+    """
+    content = d_content.content
+    d_artifacts = [da for da in d_content.d_artifacts if not da.deferred_download]
+    if not content.sha256:
+        content.sha256 = next(
+            (
+                da.artifact.sha256
+                for da in d_artifacts
+                if os.path.basename(da.relative_path) == "Packages"
+            ),
+            None,
+        )
+    if content.sha256 and [da for da in d_artifacts if da.artifact.sha256 == content.sha256]:
+        return
+    # No main_artifact found, use one that was uncompressed while downloading
+    uncompressed_artifacts = [
+        da.uncompressed_artifact for da in d_artifacts if getattr(da, "uncompressed_artifact", None)
+    ]
+    if uncompressed_artifacts:
+        artifact = uncompressed_artifacts[0]
+        filename = artifact.file.name
+    else:
+        # The compressed artifacts were not downloaded, uncompress one
+        relative_dir = os.path.dirname(content.relative_path)
+        filename = _uncompress_artifact(d_artifacts, relative_dir)
+        artifact = Artifact.init_and_validate(
+            filename, expected_digests={"sha256": content.sha256} if content.sha256 else None
+        )
+    if not content.sha256:
+        content.sha256 = artifact.sha256
+    existing_artifact = Artifact.objects.filter(sha256=artifact.sha256).first()
+    if existing_artifact:
+        artifact = existing_artifact
+    else:
+        artifact.save()
+    da = DeclarativeArtifact(
+        artifact,
+        filename,
+        content.relative_path,
+        d_artifacts[0].remote,
+    )
+    d_content.d_artifacts.append(da)
+
+
 def _uncompress_artifact(d_artifacts, relative_dir):
     for d_artifact in d_artifacts:
         ext = os.path.splitext(d_artifact.relative_path)[1]
@@ -418,22 +1022,95 @@ class DebDropFailedArtifacts(Stage):
             await self.put(d_content)
 
 
+class _ConcurrencyLimit:
+    """
+    Run coroutines concurrently, but not more than a given number at a time.
+
+    The number of coroutines started and finished is recorded in an optional progress report.
+    """
+
+    def __init__(self, limit=None, progress_report=None):
+        """
+        Run coroutines concurrently, but not more than a given number at a time.
+
+        Args:
+            limit (int): The maximum number of coroutines running at a time, None for no limit.
+            progress_report (ProgressReport): Records the total number of coroutines as total
+                and the number of finished ones as done.
+
+        """
+        self.limit = limit
+        self.progress_report = progress_report
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+    async def gather(self, coroutines):
+        """
+        Run the coroutines and return their results in order, like asyncio.gather.
+        """
+        if self.progress_report:
+            self.progress_report.total += len(coroutines)
+            self.progress_report.save()
+        return await asyncio.gather(*[self._run(coroutine) for coroutine in coroutines])
+
+    async def _run(self, coroutine):
+        if self._semaphore:
+            async with self._semaphore:
+                result = await coroutine
+        else:
+            result = await coroutine
+        if self.progress_report:
+            self.progress_report.increment()
+        return result
+
+
+def _concurrency_message(message, limit):
+    if limit:
+        return "{} (at most {} concurrently)".format(message, limit)
+    return message
+
+
 class DebFirstStage(Stage):
     """
     The first stage of a pulp_deb sync pipeline.
     """
 
-    def __init__(self, remote, *args, **kwargs):
+    def __init__(self, remote, *args, previous_version=None, base_version=None, **kwargs):
         """
         The first stage of a pulp_deb sync pipeline.
 
         Args:
             remote (FileRemote): The remote data to be used when syncing
+            previous_version (RepositoryVersion): If provided, package indices that are also
+                contained in this repository version are not parsed again
+            base_version (RepositoryVersion): If provided, the package indices of this repository
+                version are updated using pdiffs, and only the packages that are not contained in
+                this repository version are resolved by the pipeline. Defaults to the
+                previous_version.
 
         """
         super().__init__(*args, **kwargs)
         self.remote = remote
         self.parsed_url = urlparse(remote.url)
+        self._parse_pool = None
+        self.previous_version = previous_version
+        self.base_version = base_version or previous_version
+        # Primary keys of the content of the base version, that is kept, and of the package release
+        # components, without passing the pipeline. Associated by the DebContentAssociation stage.
+        self.carried_over = set()
+        self.base_package_indices = {}
+        if self.base_version:
+            self.base_package_indices = {
+                package_index.relative_path: package_index
+                for package_index in PackageIndex.objects.filter(pk__in=self.base_version.content)
+            }
+        self.previous_package_indices = {}
+        if previous_version == self.base_version:
+            self.previous_package_indices = self.base_package_indices
+        elif previous_version:
+            self.previous_package_indices = {
+                package_index.relative_path: package_index
+                for package_index in PackageIndex.objects.filter(pk__in=previous_version.content)
+            }
 
     async def run(self):
         """
@@ -442,23 +1119,86 @@ class DebFirstStage(Stage):
         if "md5" not in settings.ALLOWED_CONTENT_CHECKSUMS and settings.FORBIDDEN_CHECKSUM_WARNINGS:
             log.warning(_(NO_MD5_WARNING_MESSAGE))
 
-        await asyncio.gather(
-            *[self._handle_distribution(dist) for dist in self.remote.distributions.split()]
-        )
+        if settings.SYNC_PARSE_WORKERS > 0:
+            self._parse_pool = ProcessPoolExecutor(max_workers=settings.SYNC_PARSE_WORKERS)
+        try:
+            await self._handle_distributions()
+        finally:
+            if self._parse_pool:
+                self._parse_pool.shutdown()
+                self._parse_pool = None
+
+    async def _handle_distributions(self):
+        remote = self.remote
+        with ProgressReport(
+            message=_concurrency_message(
+                "Parsing distributions", remote.max_concurrent_distributions
+            ),
+            code="sync.parsing.distributions",
+            total=0,
+        ) as distributions_pb, ProgressReport(
+            message=_concurrency_message("Parsing components", remote.max_concurrent_components),
+            code="sync.parsing.components",
+            total=0,
+        ) as components_pb, ProgressReport(
+            message=_concurrency_message("Parsing indices", remote.max_concurrent_indices),
+            code="sync.parsing.indices",
+            total=0,
+        ) as indices_pb:
+            self.distribution_limit = _ConcurrencyLimit(
+                remote.max_concurrent_distributions, distributions_pb
+            )
+            self.component_limit = _ConcurrencyLimit(
+                remote.max_concurrent_components, components_pb
+            )
+            self.index_limit = _ConcurrencyLimit(remote.max_concurrent_indices, indices_pb)
+            await self.distribution_limit.gather(
+                [self._handle_distribution(dist) for dist in remote.distributions.split()]
+            )
 
     async def _create_unit(self, d_content):
         await self.put(d_content)
         return await d_content.resolution()
 
-    def _to_d_artifact(self, relative_path, data=None):
+    def _to_d_artifact(self, relative_path, data=None, deferred_download=False):
         artifact = Artifact(**_get_checksums(data or {}))
         url_path = os.path.join(self.parsed_url.path, relative_path)
         return DeclarativeFailsafeArtifact(
+            artifact,
+            urlunparse(self.parsed_url._replace(path=url_path)),
+            relative_path,
+            self.remote,
+            deferred_download=deferred_download,
+        )
+
+    def _to_deferred_package_index_d_artifacts(self, release_base_path, paths, file_references):
+        """
+        Declare the compressed variants of a package index, that are not downloaded.
+
+        Only RemoteArtifacts are created for them, so a verbatim publication serves every variant
+        listed in the Release file on demand. The uncompressed variant is never deferred, because
+        it is always available as an artifact.
+        """
+        return [
+            self._to_d_artifact(
+                os.path.join(release_base_path, path), file_references[path], deferred_download=True
+            )
+            for path in paths
+            if os.path.basename(path) != "Packages"
+        ]
+
+    def _to_package_index_d_artifact(self, relative_path, data, uncompressed_sha256):
+        if os.path.splitext(relative_path)[1] not in DECOMPRESSORS:
+            return self._to_d_artifact(relative_path, data)
+        artifact = Artifact(**_get_checksums(data))
+        url_path = os.path.join(self.parsed_url.path, relative_path)
+        return DeclarativePackageIndexArtifact(
             artifact,
             urlunparse(self.parsed_url._replace(path=url_path)),
             relative_path,
             self.remote,
             deferred_download=False,
+            uncompressed_sha256=uncompressed_sha256,
         )
 
     async def _handle_distribution(self, distribution):
@@ -502,8 +1242,8 @@ class DebFirstStage(Stage):
             if digest_name in release_file_dict:
                 for unit in release_file_dict[digest_name]:
                     file_references[unit["Name"]].update(unit)
-        await asyncio.gather(
-            *[
+        await self.component_limit.gather(
+            [
                 self._handle_component(
                     component, release, release_file, file_references, architectures
                 )
@@ -557,7 +1297,7 @@ class DebFirstStage(Stage):
             )
         if self.remote.sync_sources:
             raise NotImplementedError("Syncing source repositories is not yet implemented.")
-        await asyncio.gather(*pending_tasks)
+        await self.index_limit.gather(pending_tasks)
 
     async def _handle_package_index(
         self, release_file, release_component, architecture, file_references, infix=""
@@ -571,26 +1311,128 @@ class DebFirstStage(Stage):
             package_index_dir = os.path.join(
                 release_component.plain_component, infix, "binary-{}".format(architecture)
             )
-        d_artifacts = []
-        for filename in ["Packages", "Packages.gz", "Packages.xz", "Release"]:
-            path = os.path.join(package_index_dir, filename)
-            if path in file_references:
-                relative_path = os.path.join(release_base_path, path)
-                d_artifacts.append(self._to_d_artifact(relative_path, file_references[path]))
-        if not d_artifacts:
+        uncompressed_sha256 = file_references.get(
+            os.path.join(package_index_dir, "Packages"), {}
+        ).get("SHA256")
+        paths = _package_index_paths(
+            package_index_dir, self.remote.package_index_preference, file_references
+        )
+        release_path = os.path.join(package_index_dir, "Release")
+        if not paths and release_path not in file_references:
             # No reference here, skip this component architecture combination
             return
-        log.info(_("Downloading: {}/Packages").format(package_index_dir))
-        content_unit = PackageIndex(
-            release=release_file,
-            component=release_component.component,
-            architecture=architecture,
-            sha256=d_artifacts[0].artifact.sha256,
-            relative_path=os.path.join(release_base_path, package_index_dir, "Packages"),
-        )
-        package_index = await self._create_unit(
-            DeclarativeContent(content=content_unit, d_artifacts=d_artifacts)
-        )
+        package_index_path = os.path.join(release_base_path, package_index_dir, "Packages")
+        previous_package_index = self.previous_package_indices.get(package_index_path)
+        if (
+            not infix
+            and previous_package_index
+            and _is_unchanged(previous_package_index, uncompressed_sha256, paths, file_references)
+        ):
+            log.info(_("Unchanged: {}/Packages").format(package_index_dir))
+            self._carry_over_package_index(previous_package_index, release_component, architecture)
+            return
+        package_index = None
+        base_package_index = self.base_package_indices.get(package_index_path)
+        # Packages that are unchanged since the base version are not resolved by the pipeline
+        base_package_release_components = {}
+        if base_package_index and not infix:
+            base_package_release_components = self._base_package_release_components(
+                release_component, architecture
+            )
+        pdiff_index_path = os.path.join(package_index_dir, "Packages.diff", "Index")
+        if (
+            base_package_index
+            and uncompressed_sha256
+            and paths
+            and pdiff_index_path in file_references
+        ):
+            artifact = await self._patch_package_index(
+                base_package_index,
+                release_base_path,
+                package_index_dir,
+                file_references,
+                uncompressed_sha256,
+                int(file_references[paths[0]].get("Size", 0)),
+            )
+            if artifact:
+                url_path = os.path.join(self.parsed_url.path, package_index_path)
+                content_unit = PackageIndex(
+                    release=release_file,
+                    component=release_component.component,
+                    architecture=architecture,
+                    sha256=uncompressed_sha256,
+                    relative_path=package_index_path,
+                )
+                d_artifacts = [
+                    DeclarativeArtifact(
+                        artifact,
+                        urlunparse(self.parsed_url._replace(path=url_path)),
+                        package_index_path,
+                        self.remote,
+                    )
+                ]
+                if release_path in file_references:
+                    d_artifacts.append(
+                        self._to_d_artifact(
+                            os.path.join(release_base_path, release_path),
+                            file_references[release_path],
+                        )
+                    )
+                d_artifacts.extend(
+                    self._to_deferred_package_index_d_artifacts(
+                        release_base_path, paths, file_references
+                    )
+                )
+                package_index = await self._create_unit(
+                    DeclarativeContent(content=content_unit, d_artifacts=d_artifacts)
+                )
+        # A compressed package index is parsed while it is downloaded, if it is downloaded
+        records_file = None
+        for path in paths:
+            if package_index:
+                break
+            if path == paths[0]:
+                log.info(_("Downloading: {}").format(path))
+            else:
+                log.info(_("Falling back to: {}").format(path))
+            d_artifacts = [
+                self._to_package_index_d_artifact(
+                    os.path.join(release_base_path, path),
+                    file_references[path],
+                    uncompressed_sha256,
+                )
+            ]
+            if release_path in file_references:
+                d_artifacts.append(
+                    self._to_d_artifact(
+                        os.path.join(release_base_path, release_path),
+                        file_references[release_path],
+                    )
+                )
+            d_artifacts.extend(
+                self._to_deferred_package_index_d_artifacts(
+                    release_base_path, [other for other in paths if other != path], file_references
+                )
+            )
+            content_unit = PackageIndex(
+                release=release_file,
+                component=release_component.component,
+                architecture=architecture,
+                # Set from the uncompressed artifact, if the Release file does not list it
+                sha256=uncompressed_sha256,
+                relative_path=package_index_path,
+            )
+            package_index_dc = DeclarativeContent(content=content_unit, d_artifacts=d_artifacts)
+            await self.put(package_index_dc)
+            stream = getattr(d_artifacts[0], "stream", None)
+            if stream and await stream.wait_started():
+                records_file = await self._spool_package_index_records(
+                    stream, base_package_release_components
+                )
+            package_index = await package_index_dc.resolution()
+            if not package_index and records_file:
+                records_file.close()
+                records_file = None
         if not package_index:
             if self.remote.ignore_missing_package_indices:
                 log.info(_("No packages index for architecture {}. Skipping.").format(architecture))
@@ -598,55 +1440,311 @@ class DebFirstStage(Stage):
             else:
                 relative_dir = os.path.join(release_base_path, package_index_dir)
                 raise NoPackageIndexFile(relative_dir=relative_dir)
+        if records_file:
+            records = _iterate(_spooled_records(records_file))
+        else:
+            records = self._package_index_records(
+                _iterate(_package_index_chunks(package_index.main_artifact.file)),
+                base_package_release_components,
+            )
+        try:
+            await self._handle_package_index_records(
+                records, release_component, base_package_release_components, package_index_dir
+            )
+        finally:
+            if records_file:
+                records_file.close()
+
+    async def _spool_package_index_records(self, stream, known_packages):
+        """
+        Parse a package index while it is downloaded, holding back its records until the download
+        has been validated.
+
+        The records are pickled to a temporary file, so they are not held in memory.
+
+        Args:
+            stream (PackageIndexStream): The stream of the package index, that has been started.
+            known_packages: Passed on to the _parse_package_index function.
+
+        Returns:
+            file: The temporary file to read the records from using _spooled_records, or None if
+                the download failed.
+
+        """
+        records_file = TemporaryFile(dir=".")
+        try:
+            async for record in self._package_index_records(stream.chunks(), known_packages):
+                pickle.dump(record, records_file, pickle.HIGHEST_PROTOCOL)
+        except Exception as e:
+            records_file.close()
+            if e is not stream.error:
+                raise
+            # The records of a package index, that failed to download, are discarded
+            return None
+        records_file.seek(0)
+        return records_file
+
+    async def _handle_package_index_records(
+        self, records, release_component, base_package_release_components, package_index_dir
+    ):
+        """
+        Emit and link the packages of the records of a package index.
+
+        Packages contained in base_package_release_components are carried over instead, without
+        passing the pipeline.
+        """
         # Interpret policy to download Artifacts or not
         deferred_download = self.remote.policy != Remote.IMMEDIATE
-        # parse package_index
+        # Parse package_index, resolving and linking the packages in windows of bounded size
         package_futures = []
-        for package_paragraph in deb822.Packages.iter_paragraphs(package_index.main_artifact.file):
-            try:
-                package_relpath = os.path.normpath(package_paragraph["Filename"])
-                package_sha256 = package_paragraph["sha256"]
-                if package_relpath.endswith(".deb"):
-                    package_class = Package
-                    serializer_class = Package822Serializer
-                elif package_relpath.endswith(".udeb"):
-                    package_class = InstallerPackage
-                    serializer_class = InstallerPackage822Serializer
-                log.debug(_("Downloading package {}").format(package_paragraph["Package"]))
-                serializer = serializer_class.from822(data=package_paragraph)
-                serializer.is_valid(raise_exception=True)
-                package_content_unit = package_class(
-                    relative_path=package_relpath,
-                    sha256=package_sha256,
-                    **serializer.validated_data,
+        added_count = 0
+        unchanged_count = 0
+        async for package_fields, checksums in records:
+            package_relpath = package_fields["relative_path"]
+            if checksums is None:
+                self.carried_over.update(
+                    base_package_release_components[(package_relpath, package_fields["sha256"])]
                 )
-                package_path = os.path.join(self.parsed_url.path, package_relpath)
-                package_da = DeclarativeArtifact(
-                    artifact=Artifact(**_get_checksums(package_paragraph)),
-                    url=urlunparse(self.parsed_url._replace(path=package_path)),
-                    relative_path=package_relpath,
-                    remote=self.remote,
-                    deferred_download=deferred_download,
+                unchanged_count += 1
+                continue
+            if package_relpath.endswith(".deb"):
+                package_class = Package
+            elif package_relpath.endswith(".udeb"):
+                package_class = InstallerPackage
+            else:
+                log.warning(_("Ignoring package with unknown type '{}'.").format(package_relpath))
+                continue
+            log.debug(_("Downloading package {}").format(package_fields["package"]))
+            package_content_unit = package_class(**package_fields)
+            package_path = os.path.join(self.parsed_url.path, package_relpath)
+            package_da = DeclarativeArtifact(
+                artifact=Artifact(**_get_checksums(checksums)),
+                url=urlunparse(self.parsed_url._replace(path=package_path)),
+                relative_path=package_relpath,
+                remote=self.remote,
+                deferred_download=deferred_download,
+            )
+            package_dc = DeclarativeContent(content=package_content_unit, d_artifacts=[package_da])
+            package_futures.append(package_dc)
+            await self.put(package_dc)
+            if len(package_futures) >= PACKAGE_WINDOW_SIZE:
+                await self._link_packages(package_futures, release_component)
+                added_count += len(package_futures)
+                package_futures = []
+        await self._link_packages(package_futures, release_component)
+        if base_package_release_components:
+            log.info(
+                _("Carried over {} unchanged and added {} packages: {}/Packages").format(
+                    unchanged_count,
+                    added_count + len(package_futures),
+                    package_index_dir,
                 )
-                package_dc = DeclarativeContent(
-                    content=package_content_unit, d_artifacts=[package_da]
+            )
+
+    async def _package_index_records(self, chunks, known_packages):
+        """
+        Parse chunks of whole Packages paragraphs, yielding records like _parse_package_index.
+
+        If SYNC_PARSE_WORKERS is set, the chunks are parsed by the processes of the parse pool, so
+        the event loop is not blocked. Up to one chunk per process is parsed ahead of the records
+        consumed.
+
+        Args:
+            chunks: An asynchronous iterator of chunks, like _package_index_chunks yields them.
+            known_packages: Passed on to the _parse_package_index function.
+
+        """
+        if not self._parse_pool:
+            async for chunk in chunks:
+                for record in _parse_package_index(io.BytesIO(chunk), known_packages):
+                    yield record
+            return
+        loop = asyncio.get_event_loop()
+        pending = deque()
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < settings.SYNC_PARSE_WORKERS:
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    exhausted = True
+                    break
+                pending.append(
+                    loop.run_in_executor(self._parse_pool, _parse_package_index_chunk, chunk)
                 )
-                package_futures.append(package_dc)
-                await self.put(package_dc)
-            except KeyError:
-                log.warning(_("Ignoring invalid package paragraph. {}").format(package_paragraph))
-        # Assign packages to this release_component
-        for package_future in package_futures:
-            package = await package_future.resolution()
-            if not isinstance(package, Package):
-                # TODO repeat this for installer packages
-                continue
-            package_release_component_dc = DeclarativeContent(
-                content=PackageReleaseComponent(
-                    package=package, release_component=release_component
+            if not pending:
+                return
+            for package_fields, checksums in await pending.popleft():
+                key = (package_fields["relative_path"], package_fields["sha256"])
+                if key in known_packages:
+                    yield {"relative_path": key[0], "sha256": key[1]}, None
+                else:
+                    yield package_fields, checksums
+
+    async def _link_packages(self, package_futures, release_component):
+        """
+        Wait for the resolution of emitted packages and assign them to the release component.
+
+        The package release components are saved already, so they are associated with the new
+        version by the DebContentAssociation stage, without passing the pipeline.
+        """
+        packages = await asyncio.gather(
+            *[package_future.resolution() for package_future in package_futures]
+        )
+        # TODO repeat this for installer packages
+        packages = [package for package in packages if isinstance(package, Package)]
+        self.carried_over.update(
+            package_release_component.pk
+            for package_release_component in _get_or_create_package_release_components(
+                packages, release_component
+            )
+        )
+
+    def _base_package_release_components(self, release_component, architecture):
+        """
+        Map the packages of the base version, that are assigned to a release component, onto the
+        primary keys of their package release components and themselves.
+
+        Packages of architecture "all" are contained in the package indices of all architectures.
+
+        Returns:
+            dict: Tuples of the primary keys of a package release component and its package, keyed
+                by the relative_path and sha256 of the package.
+
+        """
+        package_release_components = PackageReleaseComponent.objects.filter(
+            pk__in=self.base_version.content,
+            release_component=release_component,
+            package__architecture__in=[architecture, "all"],
+        ).values_list("package__relative_path", "package__sha256", "pk", "package_id")
+        return {
+            (relative_path, sha256): (pk, package_pk)
+            for relative_path, sha256, pk, package_pk in package_release_components.iterator()
+        }
+
+    async def _download(self, relative_path, sha256=None):
+        """
+        Download a file of the remote repository, that is not stored as an artifact.
+
+        Returns:
+            bytes: The content of the file.
+
+        """
+        url_path = os.path.join(self.parsed_url.path, relative_path)
+        downloader = self.remote.get_downloader(
+            url=urlunparse(self.parsed_url._replace(path=url_path)),
+            expected_digests={"sha256": sha256} if sha256 else None,
+        )
+        result = await downloader.run()
+        with open(result.path, "rb") as downloaded_file:
+            data = downloaded_file.read()
+        os.remove(result.path)
+        return data
+
+    async def _patch_package_index(
+        self,
+        base_package_index,
+        release_base_path,
+        package_index_dir,
+        file_references,
+        uncompressed_sha256,
+        package_index_size,
+    ):
+        """
+        Update the Packages file of a package index of the base version using pdiffs.
+
+        Only the patches needed to turn the base Packages file into the one referenced by the
+        Release file are downloaded. They are not used, if they are larger than the package index.
+        The base Packages file is patched line by line in an executor, so neither is it read into
+        memory, nor is the event loop blocked.
+
+        Returns:
+            Artifact: A saved artifact of the updated Packages file, or None if the pdiffs could
+                not be applied.
+
+        """
+        pdiff_dir = os.path.join(package_index_dir, "Packages.diff")
+        pdiff_index_path = os.path.join(pdiff_dir, "Index")
+        patched_file = None
+        try:
+            pdiff_index = _parse_pdiff_index(
+                await self._download(
+                    os.path.join(release_base_path, pdiff_index_path),
+                    file_references[pdiff_index_path].get("SHA256"),
                 )
             )
-            await self.put(package_release_component_dc)
+            if pdiff_index["current"] != uncompressed_sha256:
+                log.info(_("Outdated pdiff index: {}").format(pdiff_index_path))
+                return None
+            patch_names = _pdiff_patch_names(pdiff_index, base_package_index.sha256)
+            if patch_names is None:
+                log.info(_("No pdiffs available for the base of: {}").format(pdiff_index_path))
+                return None
+            downloads = [pdiff_index["downloads"][name + ".gz"] for name in patch_names]
+            if sum(size for _sha256, size in downloads) > package_index_size:
+                log.info(_("Pdiffs are larger than the package index: {}").format(pdiff_dir))
+                return None
+            log.info(_("Downloading {} pdiffs: {}").format(len(patch_names), pdiff_dir))
+            patches = await asyncio.gather(
+                *[
+                    self._download(os.path.join(release_base_path, pdiff_dir, name + ".gz"), sha256)
+                    for name, (sha256, _size) in zip(patch_names, downloads)
+                ]
+            )
+            scripts = []
+            for name, patch in zip(patch_names, patches):
+                script = gzip.decompress(patch)
+                if hashlib.sha256(script).hexdigest() != pdiff_index["patches"][name]:
+                    raise ValueError("Checksum mismatch of pdiff '{}'.".format(name))
+                scripts.append(script)
+            base_file = base_package_index.main_artifact.file
+            patched_file = NamedTemporaryFile(dir=".", delete=False)
+            with patched_file, base_file.open("rb"):
+                await asyncio.get_event_loop().run_in_executor(
+                    None, _apply_ed_scripts, base_file, scripts, patched_file
+                )
+        except (
+            aiohttp.ClientError,
+            DigestValidationError,
+            EOFError,
+            KeyError,
+            OSError,
+            ValueError,
+        ) as e:
+            log.info(_("Failed to apply the pdiffs of {}: {}").format(pdiff_dir, e))
+            if patched_file:
+                os.remove(patched_file.name)
+            return None
+        try:
+            artifact = Artifact.init_and_validate(
+                patched_file.name, expected_digests={"sha256": uncompressed_sha256}
+            )
+        except DigestValidationError:
+            log.info(_("Checksum mismatch after applying the pdiffs of: {}").format(pdiff_dir))
+            os.remove(patched_file.name)
+            return None
+        existing_artifact = Artifact.objects.filter(sha256=artifact.sha256).first()
+        if existing_artifact:
+            return existing_artifact
+        artifact.save()
+        return artifact
+
+    def _carry_over_package_index(self, package_index, release_component, architecture):
+        """
+        Carry over an unchanged package index, together with its packages, from the previous
+        version, without passing the pipeline.
+
+        Packages of architecture "all" are contained in the package indices of all architectures,
+        so they are carried over with every package index of the release component.
+        """
+        self.carried_over.add(package_index.pk)
+        package_release_components = PackageReleaseComponent.objects.filter(
+            pk__in=self.previous_version.content,
+            release_component=release_component,
+            package__architecture__in=[architecture, "all"],
+        ).values_list("pk", "package_id")
+        for pks in package_release_components.iterator():
+            self.carried_over.update(pks)
 
     async def _handle_installer_file_index(
         self, release_file, release_component, architecture, file_references
@@ -729,6 +1827,365 @@ class DebFirstStage(Stage):
             )
 
 
+# Maps lower case Debian field names onto the fields of the package models:
+_PACKAGE_INDEX_FIELDS = {
+    deb_field.lower(): model_field
+    for model_field, deb_field in Package822Serializer.TRANSLATION_DICT.items()
+}
+# Maps lower case Debian checksum field names onto their canonical spelling:
+_PACKAGE_INDEX_CHECKSUMS = {
+    deb_field.lower(): deb_field for deb_field in CHECKSUM_TYPE_MAP.values()
+}
+_PACKAGE_INDEX_REQUIRED_FIELDS = ("package", "version", "architecture", "maintainer", "description")
+_PACKAGE_INDEX_YES_NO_FIELDS = ("essential", "build_essential")
+
+
+def _package_index_paths(package_index_dir, preference, file_references):
+    """
+    Get the paths of the Packages index variants listed in a Release file, in order of preference.
+
+    Args:
+        package_index_dir (str): The directory of the package index, relative to the Release file.
+        preference (str): Whitespace separated list of the preferred variants. The variants missing
+            from it come after the preferred ones.
+        file_references (dict): The files listed in the Release file, keyed by their path.
+
+    Returns:
+        list: The paths of the variants to try, relative to the Release file.
+
+    """
+    preference = preference.split()
+    variants = preference + [
+        variant for variant in PACKAGE_INDEX_VARIANTS if variant not in preference
+    ]
+    paths = [
+        os.path.join(package_index_dir, PACKAGE_INDEX_VARIANTS[variant]) for variant in variants
+    ]
+    return [path for path in paths if path in file_references]
+
+
+def _is_unchanged(package_index, uncompressed_sha256, paths, file_references):
+    """
+    Check whether a package index is unchanged, according to the checksums of a Release file.
+
+    If the Release file does not list the uncompressed package index, the checksums of the listed
+    variants are compared with the artifacts of the package index instead.
+    """
+    if uncompressed_sha256:
+        return package_index.sha256 == uncompressed_sha256
+    sha256s = [
+        file_references[path]["SHA256"] for path in paths if "SHA256" in file_references[path]
+    ]
+    return bool(sha256s) and package_index._artifacts.filter(sha256__in=sha256s).exists()
+
+
+def _parse_package_index(package_index_file, known_packages=()):
+    """
+    Parse a Packages file in a single pass, without building a deb822 paragraph per package.
+
+    Paragraphs are split on blank lines. Only the fields known to the package models, the
+    "Filename" and the checksums are retained, any other fields are skipped while reading.
+    Paragraphs that are missing required fields or contain invalid values are logged and skipped.
+
+    Args:
+        package_index_file: A binary file like object yielding the lines of a Packages file.
+        known_packages: A container of (relative_path, sha256) tuples of packages, whose
+            paragraphs are not converted. Only their "relative_path" and "sha256" are yielded, with
+            None instead of the checksums.
+
+    Yields:
+        tuple: A dict of package model fields (including "relative_path" and "sha256") and a dict
+            of the checksums of the package file, keyed by Debian checksum field names.
+
+    """
+    paragraph = {}
+    field = None
+    for line in package_index_file:
+        line = line.decode("utf-8", errors="replace").rstrip("\r\n")
+        if not line.strip():
+            if paragraph:
+                record = _package_index_record(paragraph, known_packages)
+                if record:
+                    yield record
+                paragraph = {}
+            field = None
+        elif line[0] in " \t":
+            # Continuation line of a multiline field
+            if field:
+                paragraph[field].append(line)
+        else:
+            name, _sep, value = line.partition(":")
+            field = name.strip().lower()
+            if field in _PACKAGE_INDEX_FIELDS or field in _PACKAGE_INDEX_CHECKSUMS:
+                paragraph[field] = [value.strip()]
+            elif field == "filename":
+                paragraph[field] = [value.strip()]
+            else:
+                # Skip fields (and their continuation lines) we do not store
+                field = None
+    if paragraph:
+        record = _package_index_record(paragraph, known_packages)
+        if record:
+            yield record
+
+
+def _package_index_chunks(package_index_file, size=PACKAGE_INDEX_CHUNK_SIZE):
+    """
+    Split a Packages file into chunks of whole paragraphs.
+
+    Args:
+        package_index_file: A binary file like object of a Packages file.
+        size (int): The number of bytes to read at a time. Chunks are split at the last paragraph
+            boundary, so they can be smaller or larger.
+
+    Yields:
+        bytes: Chunks of the Packages file.
+
+    """
+    rest = b""
+    while True:
+        data = package_index_file.read(size)
+        if not data:
+            break
+        chunk, rest = _split_package_index_data(rest + data)
+        if chunk:
+            yield chunk
+    if rest:
+        yield rest
+
+
+async def _iterate(iterable):
+    """
+    Turn an iterable into an asynchronous iterator.
+    """
+    for item in iterable:
+        yield item
+
+
+def _spooled_records(records_file):
+    """
+    Read the records pickled to a file by DebFirstStage._spool_package_index_records.
+    """
+    while True:
+        try:
+            yield pickle.load(records_file)
+        except EOFError:
+            return
+
+
+def _split_package_index_data(data):
+    """
+    Split data of a Packages file after the last paragraph boundary.
+
+    Returns:
+        tuple: The whole paragraphs contained in the data, and the rest of the data.
+
+    """
+    end = data.rfind(b"\n\n")
+    if end == -1:
+        return b"", data
+    return data[: end + 2], data[end + 2 :]
+
+
+def _parse_package_index_chunk(chunk):
+    """
+    Parse a chunk of whole Packages paragraphs, in a process of the parse pool.
+
+    Returns:
+        list: The records of the _parse_package_index function.
+
+    """
+    return list(_parse_package_index(io.BytesIO(chunk)))
+
+
+def _package_index_record(paragraph, known_packages=()):
+    """
+    Convert the raw field values of a single Packages paragraph into a package index record.
+
+    Values are converted the same way the Package822Serializer would convert them.
+    """
+    if known_packages and "filename" in paragraph and "sha256" in paragraph:
+        key = (os.path.normpath(paragraph["filename"][0]), paragraph["sha256"][0])
+        if key in known_packages:
+            return {"relative_path": key[0], "sha256": key[1]}, None
+    values = {field: "\n".join(lines).strip() for field, lines in paragraph.items()}
+    package_fields = {}
+    checksums = {}
+    for field, value in values.items():
+        if not value:
+            continue
+        if field in _PACKAGE_INDEX_CHECKSUMS:
+            checksums[_PACKAGE_INDEX_CHECKSUMS[field]] = value
+        if field not in _PACKAGE_INDEX_FIELDS:
+            continue
+        model_field = _PACKAGE_INDEX_FIELDS[field]
+        if model_field in _PACKAGE_INDEX_YES_NO_FIELDS:
+            value = value.lower()
+            if value not in ("yes", "no"):
+                log.warning(_("Ignoring invalid package paragraph. {}").format(values))
+                return None
+            value = value == "yes"
+        package_fields[model_field] = value
+
+    if not values.get("filename") or "SHA256" not in checksums:
+        log.warning(_("Ignoring invalid package paragraph. {}").format(values))
+        return None
+    for field in _PACKAGE_INDEX_REQUIRED_FIELDS:
+        if field not in package_fields:
+            log.warning(_("Ignoring invalid package paragraph. {}").format(values))
+            return None
+
+    package_fields["relative_path"] = os.path.normpath(values["filename"])
+    package_fields["sha256"] = checksums["SHA256"]
+    return package_fields, checksums
+
+
+def _parse_pdiff_index(data):
+    """
+    Parse a Packages.diff/Index file.
+
+    Args:
+        data (bytes): The content of the Index file.
+
+    Returns:
+        dict: The sha256 of the "current" Packages file, the "history" as a list of tuples of the
+            sha256 of a former Packages file and the name of the patch to apply to it, the sha256
+            of the uncompressed "patches" and the sha256 and size of the compressed "downloads",
+            keyed by file name, as well as whether the patches are "merged".
+
+    """
+    index = deb822.Deb822(data.decode("utf-8"))
+
+    def entries(field):
+        return [line.split() for line in index.get(field, "").splitlines() if line.strip()]
+
+    return {
+        "current": index["SHA256-Current"].split()[0],
+        "history": [(sha256, name) for sha256, _size, name in entries("SHA256-History")],
+        "patches": {name: sha256 for sha256, _size, name in entries("SHA256-Patches")},
+        "downloads": {
+            name: (sha256, int(size)) for sha256, size, name in entries("SHA256-Download")
+        },
+        "merged": index.get("X-Patch-Precedence") == "merged",
+    }
+
+
+def _pdiff_patch_names(pdiff_index, base_sha256):
+    """
+    Determine the patches needed to update a Packages file to the current one.
+
+    Args:
+        pdiff_index (dict): A parsed Packages.diff/Index file.
+        base_sha256 (str): The sha256 of the Packages file to update.
+
+    Returns:
+        list: The names of the patches to apply in order, or None if the Packages file is not
+            contained in the history of the Index file.
+
+    """
+    if base_sha256 == pdiff_index["current"]:
+        return []
+    for position, (sha256, name) in enumerate(pdiff_index["history"]):
+        if sha256 == base_sha256:
+            if pdiff_index["merged"]:
+                # Every merged patch updates its base to the current Packages file directly
+                return [name]
+            return [name for _sha256, name in pdiff_index["history"][position:]]
+    return None
+
+
+_ED_COMMAND = re.compile(rb"(\d+)(?:,(\d+))?([acd])")
+
+
+def _parse_ed_script(script):
+    """
+    Parse an ed script, as produced by "diff --ed".
+
+    The commands of such scripts are ordered by descending line numbers, so the line numbers of
+    every command refer to the unpatched file.
+
+    Args:
+        script (bytes): The ed script.
+
+    Returns:
+        list: Tuples of the first and last line, the command and the lines (bytes, including line
+            endings) to insert, ordered by ascending line numbers.
+
+    Raises:
+        ValueError: If the script contains unsupported commands or is truncated.
+
+    """
+    commands = []
+    script_lines = iter(script.splitlines(keepends=True))
+    for command in script_lines:
+        match = _ED_COMMAND.fullmatch(command.rstrip(b"\r\n"))
+        if not match:
+            raise ValueError(
+                "Unsupported ed command '{}'.".format(command.decode(errors="replace"))
+            )
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        text = []
+        if match.group(3) in b"ac":
+            for line in script_lines:
+                if line.rstrip(b"\r\n") == b".":
+                    break
+                text.append(line)
+            else:
+                raise ValueError("Truncated ed script.")
+        commands.append((start, end, match.group(3), text))
+    commands.reverse()
+    return commands
+
+
+def _patch_lines(lines, commands):
+    """
+    Apply parsed ed commands to an iterable of lines, yielding the patched lines.
+
+    Args:
+        lines (iterable): The lines (bytes, including line endings) to patch.
+        commands (list): The commands as returned by :func:`_parse_ed_script`.
+
+    Raises:
+        ValueError: If the commands overlap or refer to lines beyond the end of the file.
+
+    """
+    lines = iter(lines)
+    position = 0
+    for start, end, command, text in commands:
+        kept = start if command == b"a" else start - 1
+        if kept < position or end < start:
+            raise ValueError("Overlapping ed commands.")
+        for line in itertools.islice(lines, kept - position):
+            yield line
+            position += 1
+        if command != b"a":
+            position += sum(1 for _line in itertools.islice(lines, end - kept))
+        if position != (kept if command == b"a" else end):
+            raise ValueError("Ed command beyond the end of the file.")
+        yield from text
+    yield from lines
+
+
+def _apply_ed_scripts(base_file, scripts, patched_file):
+    """
+    Apply ed scripts one after another to a file, line by line.
+
+    Args:
+        base_file (file): The file (opened in binary mode) to patch.
+        scripts (list): The ed scripts (bytes) to apply in order.
+        patched_file (file): The file (opened in binary mode) to write the patched lines to.
+
+    Raises:
+        ValueError: If any of the scripts can not be applied.
+
+    """
+    lines = iter(base_file)
+    for script in scripts:
+        lines = _patch_lines(lines, _parse_ed_script(script))
+    patched_file.writelines(lines)
+
+
 def _get_checksums(unit_dict):
     """
     Filters the unit_dict provided to retain only checksum fields present in the
@@ -84,6 +84,8 @@ class AptPublicationViewSet(PublicationViewSet):
         simple = serializer.validated_data.get("simple")
         structured = serializer.validated_data.get("structured")
         signing_service = serializer.validated_data.get("signing_service")
+        compressors = serializer.validated_data.get("compressors")
+        by_hash = serializer.validated_data.get("by_hash")
 
         result = dispatch(
             tasks.publish,
@@ -93,6 +95,8 @@ class AptPublicationViewSet(PublicationViewSet):
                 "simple": simple,
                 "structured": structured,
                 "signing_service_pk": getattr(signing_service, "pk", None),
+                "compressors": compressors,
+                "by_hash": by_hash,
             },
         )
         return OperationPostponedResponse(result, request)
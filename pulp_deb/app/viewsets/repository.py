@@ -4,10 +4,7 @@ from drf_spectacular.utils import extend_schema
 from rest_framework.decorators import action
 
 from pulpcore.plugin.actions import ModifyRepositoryActionMixin
-from pulpcore.plugin.serializers import (
-    AsyncOperationResponseSerializer,
-    RepositorySyncURLSerializer,
-)
+from pulpcore.plugin.serializers import AsyncOperationResponseSerializer
 from pulpcore.plugin.tasking import dispatch
 from pulpcore.plugin.viewsets import (
     OperationPostponedResponse,
@@ -38,13 +35,15 @@ class AptRepositoryViewSet(RepositoryViewSet, ModifyRepositoryActionMixin):
         summary="Sync from remote",
         responses={202: AsyncOperationResponseSerializer},
     )
-    @action(detail=True, methods=["post"], serializer_class=RepositorySyncURLSerializer)
+    @action(
+        detail=True, methods=["post"], serializer_class=serializers.AptRepositorySyncURLSerializer
+    )
     def sync(self, request, pk):
         """
         Dispatches a sync task.
         """
         repository = self.get_object()
-        serializer = RepositorySyncURLSerializer(
+        serializer = serializers.AptRepositorySyncURLSerializer(
             data=request.data, context={"request": request, "repository_pk": pk}
         )
 
@@ -52,6 +51,7 @@ class AptRepositoryViewSet(RepositoryViewSet, ModifyRepositoryActionMixin):
         serializer.is_valid(raise_exception=True)
         remote = serializer.validated_data.get("remote", repository.remote)
         mirror = serializer.validated_data.get("mirror", True)
+        optimize = serializer.validated_data.get("optimize", False)
 
         result = dispatch(
             tasks.synchronize,
@@ -60,6 +60,7 @@ class AptRepositoryViewSet(RepositoryViewSet, ModifyRepositoryActionMixin):
                 "remote_pk": remote.pk,
                 "repository_pk": repository.pk,
                 "mirror": mirror,
+                "optimize": optimize,
             },
         )
         return OperationPostponedResponse(result, request)
@@ -0,0 +1,178 @@
+# coding=utf-8
+"""Tests that verify the publish options of the apt publisher."""
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+import unittest
+
+from pulp_smash import config
+from pulp_smash.pulp3.bindings import monitor_task
+from pulp_smash.pulp3.utils import (
+    delete_orphans,
+    download_content_unit,
+    gen_distribution,
+    gen_repo,
+    get_content,
+    modify_repo,
+)
+
+from pulp_deb.tests.functional.constants import DEB_PACKAGE_NAME
+from pulp_deb.tests.functional.utils import set_up_module as setUpModule  # noqa:F401
+from pulp_deb.tests.functional.utils import (
+    deb_apt_publication_api,
+    deb_distribution_api,
+    deb_remote_api,
+    deb_repository_api,
+    gen_deb_remote,
+    parse_release_checksums,
+)
+
+from pulpcore.client.pulp_deb import DebAptPublication, RepositorySyncURL
+
+
+class PublishOptionsTestCase(unittest.TestCase):
+    """Base class to publish a synced repository with certain options."""
+
+    distribution = "ragnarok"
+
+    @classmethod
+    def setUpClass(cls):
+        """Create class-wide variables."""
+        cls.cfg = config.get_config()
+
+    def setUp(self):
+        """Create a repository synced from a remote and a distribution for it."""
+        delete_orphans()
+        self.repo = deb_repository_api.create(gen_repo())
+        self.addCleanup(deb_repository_api.delete, self.repo.pulp_href)
+
+        remote = deb_remote_api.create(gen_deb_remote())
+        self.addCleanup(deb_remote_api.delete, remote.pulp_href)
+
+        repository_sync_data = RepositorySyncURL(remote=remote.pulp_href)
+        sync_response = deb_repository_api.sync(self.repo.pulp_href, repository_sync_data)
+        monitor_task(sync_response.task)
+        self.repo = deb_repository_api.read(self.repo.pulp_href)
+
+        distribution_response = deb_distribution_api.create(gen_distribution())
+        distribution_href = monitor_task(distribution_response.task).created_resources[0]
+        self.addCleanup(deb_distribution_api.delete, distribution_href)
+        self.distribution_href = distribution_href
+
+    def publish(self, **kwargs):
+        """Publish the latest repository version and serve it with the distribution."""
+        publish_data = DebAptPublication(repository=self.repo.pulp_href, structured=True, **kwargs)
+        publish_response = deb_apt_publication_api.create(publish_data)
+        publication_href = monitor_task(publish_response.task).created_resources[0]
+        self.addCleanup(deb_apt_publication_api.delete, publication_href)
+
+        distribution_response = deb_distribution_api.partial_update(
+            self.distribution_href, {"publication": publication_href}
+        )
+        monitor_task(distribution_response.task)
+        return publication_href
+
+    def download(self, path):
+        """Download a file of the distribution."""
+        distribution = deb_distribution_api.read(self.distribution_href)
+        return download_content_unit(self.cfg, distribution.to_dict(), path)
+
+    def download_release(self):
+        """Download the Release file of the distribution."""
+        return self.download(os.path.join("dists", self.distribution, "Release"))
+
+
+class PublishCompressorsTestCase(PublishOptionsTestCase):
+    """Publish a repository with the compressors option."""
+
+    decompressors = {
+        "": lambda data: data,
+        ".gz": gzip.decompress,
+        ".bz2": bz2.decompress,
+        ".xz": lzma.decompress,
+    }
+
+    def assert_packages_indices(self, extensions):
+        """Assert that exactly the given variants of each Packages index are published.
+
+        Every variant must be listed in the Release file with the checksum of the published file,
+        and all variants of an index must have the same content.
+        """
+        checksums = parse_release_checksums(self.download_release())
+        indices = [path for path in checksums if os.path.basename(path) == "Packages"]
+        self.assertTrue(indices)
+        for index in indices:
+            listed = {path[len(index) :] for path in checksums if path.startswith(index)}
+            self.assertEqual(listed, {""} | set(extensions))
+            contents = set()
+            for extension in listed:
+                with self.subTest(path=index + extension):
+                    content = self.download(
+                        os.path.join("dists", self.distribution, index + extension)
+                    )
+                    self.assertEqual(
+                        hashlib.sha256(content).hexdigest(), checksums[index + extension][0]
+                    )
+                    contents.add(self.decompressors[extension](content))
+            self.assertEqual(len(contents), 1)
+
+    def test_default(self):
+        """Test that the Packages indices are published uncompressed and gzipped by default."""
+        self.publish()
+        self.assert_packages_indices([".gz"])
+
+    def test_xz(self):
+        """Test that Packages.xz is published and listed in the Release file."""
+        self.publish(compressors="xz:9 gz")
+        self.assert_packages_indices([".xz", ".gz"])
+
+    def test_uncompressed(self):
+        """Test that only the uncompressed Packages indices are published without compressors."""
+        self.publish(compressors="")
+        self.assert_packages_indices([])
+
+
+class PublishByHashTestCase(PublishOptionsTestCase):
+    """Publish a repository with the by_hash option."""
+
+    def assert_by_hash(self, release):
+        """Assert that every index listed in the Release file is available by its checksum."""
+        checksums = parse_release_checksums(release)
+        self.assertTrue(checksums)
+        for path, (checksum, size) in checksums.items():
+            with self.subTest(path=path):
+                by_hash_path = os.path.join(
+                    "dists", self.distribution, os.path.dirname(path), "by-hash", "SHA256", checksum
+                )
+                content = self.download(by_hash_path)
+                self.assertEqual(hashlib.sha256(content).hexdigest(), checksum)
+                self.assertEqual(len(content), size)
+
+    def test_by_hash(self):
+        """Test that the Release checksums match the published by-hash files."""
+        self.publish(by_hash=True)
+        release = self.download_release()
+        self.assertIn(b"Acquire-By-Hash: yes", release)
+        self.assert_by_hash(release)
+
+    def test_by_hash_history(self):
+        """Test that the by-hash files of the previous publication are kept.
+
+        1. Publish the repository and download its Release file.
+        2. Remove a package and publish the repository again.
+        3. Assert that the indices of both Release files are available by their checksum.
+        """
+        self.publish(by_hash=True)
+        previous_release = self.download_release()
+
+        package = get_content(self.repo.to_dict())[DEB_PACKAGE_NAME][0]
+        modify_repo(self.cfg, self.repo.to_dict(), remove_units=[package])
+        self.repo = deb_repository_api.read(self.repo.pulp_href)
+        self.publish(by_hash=True)
+        release = self.download_release()
+
+        self.assertNotEqual(previous_release, release)
+        self.assert_by_hash(release)
+        self.assert_by_hash(previous_release)
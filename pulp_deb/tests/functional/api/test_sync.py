@@ -1,14 +1,20 @@
 # coding=utf-8
 """Tests that sync deb plugin repositories."""
+import hashlib
+import os
 import unittest
 
 from pulp_smash import config
 from pulp_smash.pulp3.bindings import monitor_task, PulpTaskError
 from pulp_smash.pulp3.utils import (
+    download_content_unit,
+    gen_distribution,
     gen_repo,
     get_added_content_summary,
+    get_content,
     get_content_summary,
     delete_orphans,
+    modify_repo,
 )
 
 from pulp_deb.tests.functional.constants import (
@@ -17,16 +23,20 @@ from pulp_deb.tests.functional.constants import (
     DEB_INVALID_FIXTURE_URL,
     DEB_FIXTURE_URL,
     DEB_FIXTURE_DISTRIBUTIONS,
+    DEB_PACKAGE_NAME,
     DEB_SIGNING_KEY,
 )
 from pulp_deb.tests.functional.utils import set_up_module as setUpModule  # noqa:F401
 from pulp_deb.tests.functional.utils import (
     gen_deb_remote,
+    deb_distribution_api,
     deb_remote_api,
     deb_repository_api,
+    deb_verbatim_publication_api,
+    parse_release_checksums,
 )
 
-from pulpcore.client.pulp_deb import RepositorySyncURL
+from pulpcore.client.pulp_deb import DebVerbatimPublication, RepositorySyncURL
 
 
 class BasicSyncTestCase(unittest.TestCase):
@@ -101,6 +111,160 @@ class BasicSyncTestCase(unittest.TestCase):
         self.assertDictEqual(get_content_summary(repo.to_dict()), fixture_summary)
 
 
+class OptimizedSyncTestCase(unittest.TestCase):
+    """Sync a repository with the optimize option."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Create class-wide variables."""
+        cls.cfg = config.get_config()
+
+    def setUp(self):
+        """Create a repository synced from a remote."""
+        delete_orphans()
+        self.repo_api = deb_repository_api
+        self.repo = self.repo_api.create(gen_repo())
+        self.addCleanup(self.repo_api.delete, self.repo.pulp_href)
+
+        self.remote = deb_remote_api.create(gen_deb_remote())
+        self.addCleanup(deb_remote_api.delete, self.remote.pulp_href)
+
+        self.sync()
+
+    def sync(self, **kwargs):
+        """Sync the repository from the remote and return the updated repository."""
+        repository_sync_data = RepositorySyncURL(remote=self.remote.pulp_href, **kwargs)
+        sync_response = self.repo_api.sync(self.repo.pulp_href, repository_sync_data)
+        monitor_task(sync_response.task)
+        self.repo = self.repo_api.read(self.repo.pulp_href)
+        return self.repo
+
+    def test_unchanged_remote(self):
+        """Test that an optimized sync of an unchanged remote creates no new version."""
+        latest_version_href = self.repo.latest_version_href
+        repo = self.sync(optimize=True)
+        self.assertEqual(latest_version_href, repo.latest_version_href)
+        self.assertDictEqual(get_content_summary(repo.to_dict()), DEB_FIXTURE_SUMMARY)
+
+    def test_modified_repository(self):
+        """Test that an optimized sync does not rely on a version that was not synced.
+
+        1. Remove a package from the synced repository.
+        2. Sync the repository with the optimize option.
+        3. Assert that the package was added again.
+        """
+        package = get_content(self.repo.to_dict())[DEB_PACKAGE_NAME][0]
+        modify_repo(self.cfg, self.repo.to_dict(), remove_units=[package])
+        repo = self.sync(optimize=True)
+        self.assertDictEqual(get_content_summary(repo.to_dict()), DEB_FIXTURE_SUMMARY)
+        self.assertDictEqual(get_added_content_summary(repo.to_dict()), {DEB_PACKAGE_NAME: 1})
+
+    def test_additive_sync(self):
+        """Test that an optimized mirror sync does not rely on a version synced additively."""
+        latest_version_href = self.sync(mirror=False).latest_version_href
+        repo = self.sync(mirror=True, optimize=True)
+        self.assertEqual(latest_version_href, repo.latest_version_href)
+        self.assertDictEqual(get_content_summary(repo.to_dict()), DEB_FIXTURE_SUMMARY)
+
+
+class PackageIndexPreferenceSyncTestCase(unittest.TestCase):
+    """Sync a repository with different Packages index preferences."""
+
+    def setUp(self):
+        """Cleanup."""
+        delete_orphans()
+
+    def test_preferences(self):
+        """Test that every preference syncs all packages.
+
+        The preference only orders the variants listed in the Release file, so the variants
+        missing from it are used, if none of the preferred ones is listed.
+        """
+        for preference in ("xz gz bz2 plain", "plain", "bz2"):
+            with self.subTest(preference=preference):
+                repo = deb_repository_api.create(gen_repo())
+                self.addCleanup(deb_repository_api.delete, repo.pulp_href)
+
+                body = gen_deb_remote(package_index_preference=preference)
+                remote = deb_remote_api.create(body)
+                self.addCleanup(deb_remote_api.delete, remote.pulp_href)
+
+                repository_sync_data = RepositorySyncURL(remote=remote.pulp_href)
+                sync_response = deb_repository_api.sync(repo.pulp_href, repository_sync_data)
+                monitor_task(sync_response.task)
+                repo = deb_repository_api.read(repo.pulp_href)
+
+                self.assertDictEqual(get_content_summary(repo.to_dict()), DEB_FIXTURE_SUMMARY)
+
+    def test_verbatim_variants(self):
+        """Test that a verbatim publication serves every variant listed in the Release file.
+
+        Only the plain variant is downloaded by the sync, the others are served on demand.
+        """
+        repo = deb_repository_api.create(gen_repo())
+        self.addCleanup(deb_repository_api.delete, repo.pulp_href)
+
+        remote = deb_remote_api.create(gen_deb_remote(package_index_preference="plain"))
+        self.addCleanup(deb_remote_api.delete, remote.pulp_href)
+
+        repository_sync_data = RepositorySyncURL(remote=remote.pulp_href)
+        sync_response = deb_repository_api.sync(repo.pulp_href, repository_sync_data)
+        monitor_task(sync_response.task)
+
+        publish_data = DebVerbatimPublication(repository=repo.pulp_href)
+        publish_response = deb_verbatim_publication_api.create(publish_data)
+        publication_href = monitor_task(publish_response.task).created_resources[0]
+        self.addCleanup(deb_verbatim_publication_api.delete, publication_href)
+
+        body = gen_distribution()
+        body["publication"] = publication_href
+        distribution_response = deb_distribution_api.create(body)
+        distribution_href = monitor_task(distribution_response.task).created_resources[0]
+        self.addCleanup(deb_distribution_api.delete, distribution_href)
+        distribution = deb_distribution_api.read(distribution_href).to_dict()
+
+        cfg = config.get_config()
+        release_dir = os.path.join("dists", DEB_FIXTURE_DISTRIBUTIONS.split()[0])
+        release = download_content_unit(cfg, distribution, os.path.join(release_dir, "Release"))
+        checksums = parse_release_checksums(release)
+        indices = [path for path in checksums if os.path.basename(path).startswith("Packages")]
+        self.assertTrue(indices)
+        for path in indices:
+            with self.subTest(path=path):
+                content = download_content_unit(cfg, distribution, os.path.join(release_dir, path))
+                self.assertEqual(hashlib.sha256(content).hexdigest(), checksums[path][0])
+
+
+class ConcurrencyLimitSyncTestCase(unittest.TestCase):
+    """Sync a repository with limited concurrency."""
+
+    def setUp(self):
+        """Cleanup."""
+        delete_orphans()
+
+    def test_limits(self):
+        """Test that a sync with the smallest concurrency limits syncs all content."""
+        repo = deb_repository_api.create(gen_repo())
+        self.addCleanup(deb_repository_api.delete, repo.pulp_href)
+
+        body = gen_deb_remote(
+            sync_udebs=True,
+            max_concurrent_distributions=1,
+            max_concurrent_components=1,
+            max_concurrent_indices=1,
+        )
+        remote = deb_remote_api.create(body)
+        self.addCleanup(deb_remote_api.delete, remote.pulp_href)
+        self.assertEqual(remote.max_concurrent_indices, 1)
+
+        repository_sync_data = RepositorySyncURL(remote=remote.pulp_href)
+        sync_response = deb_repository_api.sync(repo.pulp_href, repository_sync_data)
+        monitor_task(sync_response.task)
+        repo = deb_repository_api.read(repo.pulp_href)
+
+        self.assertDictEqual(get_content_summary(repo.to_dict()), DEB_FULL_FIXTURE_SUMMARY)
+
+
 class SyncInvalidTestCase(unittest.TestCase):
     """Sync a repository with a given url on the remote."""
 
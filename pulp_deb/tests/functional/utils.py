@@ -283,3 +283,22 @@ def gen_artifact(url):
         temp_file.flush()
         artifact = ArtifactsApi(core_client).create(file=temp_file.name)
         return artifact.to_dict()
+
+
+def parse_release_checksums(release, field="SHA256"):
+    """Return a dict mapping the paths listed in the given field of a Release file.
+
+    :param release: The content of a Release file as bytes.
+    :param field: The name of the checksum field.
+    :returns: A dict mapping each relative path to a tuple of checksum and size.
+    """
+    checksums = {}
+    in_field = False
+    for line in release.decode().splitlines():
+        if not line.startswith(" "):
+            in_field = line.strip() == "{}:".format(field)
+            continue
+        if in_field:
+            checksum, size, path = line.split()
+            checksums[path] = (checksum, int(size))
+    return checksums
@@ -0,0 +1,9 @@
+"""pytest configuration of the benchmarks."""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def benchmark_record_property(request, record_property):
+    """Let the BenchmarkTestCases report their measurements using record_property."""
+    if request.instance is not None:
+        request.instance.record_property = record_property
@@ -0,0 +1,51 @@
+"""
+Benchmark the parsing of Packages files during sync.
+
+These tests need a configured pulp database, run them using:
+django-admin test pulp_deb.tests.performance.test_parse_package_index
+"""
+import io
+import time
+
+from debian import deb822
+
+from pulp_deb.app.serializers import Package822Serializer
+from pulp_deb.app.tasks.synchronizing import _parse_package_index
+from pulp_deb.tests.performance.utils import BenchmarkTestCase, gen_packages_file
+
+
+PACKAGE_COUNT = 20000
+
+
+def _parse_with_serializer(package_index_file):
+    """Parse a Packages file the way sync did before the fast path parser existed."""
+    for package_paragraph in deb822.Packages.iter_paragraphs(package_index_file):
+        serializer = Package822Serializer.from822(data=package_paragraph)
+        serializer.is_valid(raise_exception=True)
+        yield serializer.validated_data
+
+
+class PackageIndexParsingBenchmark(BenchmarkTestCase):
+    """Compare the parse rate of the fast path parser with the deb822/serializer path."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Generate a synthetic Packages file."""
+        super().setUpClass()
+        cls.packages_file = gen_packages_file(PACKAGE_COUNT)
+
+    def _measure(self, parser):
+        start = time.perf_counter()
+        count = sum(1 for _record in parser(io.BytesIO(self.packages_file)))
+        duration = time.perf_counter() - start
+        self.assertEqual(count, PACKAGE_COUNT)
+        return count / duration
+
+    def test_parse_rate(self):
+        """Record the packages parsed per second by both parsers."""
+        serializer_rate = self._measure(_parse_with_serializer)
+        fast_path_rate = self._measure(_parse_package_index)
+        self.record_property("serializer_packages_per_second", serializer_rate)
+        self.record_property("fast_path_packages_per_second", fast_path_rate)
+        self.record_property("speedup", fast_path_rate / serializer_rate)
+        self.assertGreater(fast_path_rate, serializer_rate)
@@ -0,0 +1,205 @@
+"""
+Benchmark simple, structured and signed publications of a synced synthetic repository.
+
+These tests need a configured pulp database and gpg, run them using:
+django-admin test pulp_deb.tests.performance.test_publish
+"""
+import os
+import tempfile
+import time
+
+from unittest import mock
+
+import gnupg
+from django.db import connection
+from django.test import override_settings
+from pulpcore.plugin.models import PublishedMetadata
+
+from pulp_deb.app.models import AptReleaseSigningService, AptRemote, AptRepository
+from pulp_deb.app.serializers import Package822Serializer
+from pulp_deb.app.tasks import publishing
+from pulp_deb.app.tasks.publishing import publish
+from pulp_deb.app.tasks.synchronizing import synchronize
+from pulp_deb.tests.performance.utils import (
+    BenchmarkTestCase,
+    QueryCounter,
+    Timer,
+    gen_apt_repository,
+    running_task,
+    serve_directory,
+)
+
+
+RELEASES = ("stable", "testing")
+COMPONENTS = ("main", "contrib")
+ARCHITECTURES = ("amd64", "arm64")
+# The number of packages in every Packages index:
+PACKAGE_COUNT = 2000
+# The PublishedArtifacts are saved in batches, so the number of queries must not grow with every
+# package:
+MAX_QUERIES_PER_PACKAGE = 0.1
+
+SIGNING_SCRIPT = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "functional", "sign_deb_release.sh"
+)
+
+
+class _TimedFile:
+    """Proxy for a file object, adding the time spent writing to it to a Timer."""
+
+    def __init__(self, file, timer):
+        self._file = file
+        self.write = timer.wrap(file.write)
+        self.close = timer.wrap(file.close)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class PublishBenchmark(BenchmarkTestCase):
+    """Measure the publications of a synthetic repository."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Sync a synthetic repository, serving as the source of all publications."""
+        with tempfile.TemporaryDirectory() as repository_dir:
+            cls.package_count = gen_apt_repository(
+                repository_dir, RELEASES, COMPONENTS, ARCHITECTURES, PACKAGE_COUNT
+            )
+            with serve_directory(repository_dir) as url:
+                remote = AptRemote.objects.create(
+                    name="benchmark",
+                    url=url,
+                    distributions=" ".join(RELEASES),
+                    policy=AptRemote.ON_DEMAND,
+                )
+                repository = AptRepository.objects.create(name="benchmark")
+                with running_task("sync"):
+                    synchronize(remote.pk, repository.pk, mirror=False)
+        cls.repository_version = repository.latest_version()
+
+    def setUp(self):
+        """Change to a temporary working directory, like a task does."""
+        self.cwd = os.getcwd()
+        self.working_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.working_dir.name)
+
+    def tearDown(self):
+        """Return to the original working directory."""
+        os.chdir(self.cwd)
+        self.working_dir.cleanup()
+
+    def _create_signing_service(self):
+        gnupghome = os.path.join(self.working_dir.name, "gnupg")
+        os.mkdir(gnupghome, 0o700)
+        gpg = gnupg.GPG(gnupghome=gnupghome)
+        key = gpg.gen_key(
+            gpg.gen_key_input(
+                name_real="Pulp QE",
+                name_email="pulp-qe@example.com",
+                key_type="RSA",
+                key_length=2048,
+                no_protection=True,
+            )
+        )
+        # The signing service runs its script with an empty environment:
+        script = os.path.join(self.working_dir.name, "sign.sh")
+        with open(script, "w") as script_file:
+            script_file.write(
+                '#!/bin/bash\nexport GNUPGHOME="{}"\nexec "{}" "$@"\n'.format(
+                    gnupghome, SIGNING_SCRIPT
+                )
+            )
+        os.chmod(script, 0o755)
+        return AptReleaseSigningService.objects.create(
+            name="benchmark",
+            script=script,
+            public_key=gpg.export_keys(key.fingerprint),
+            pubkey_fingerprint=key.fingerprint,
+        )
+
+    def _measure(self, **kwargs):
+        """
+        Publish the synced repository version, record its measurements and assert the number of
+        queries is bounded.
+
+        Returns:
+            dict: The measurements of the publication.
+
+        """
+        query_counter = QueryCounter()
+        render_timer = Timer()
+        compression_timer = Timer()
+        metadata_timer = Timer()
+        compressor_files = {
+            compressor: (
+                lambda path, level, open_file=open_file: _TimedFile(
+                    open_file(path, level), compression_timer
+                )
+            )
+            for compressor, open_file in publishing._COMPRESSOR_FILES.items()
+        }
+        with mock.patch.object(
+            Package822Serializer,
+            "model_to822",
+            render_timer.wrap(Package822Serializer.model_to822),
+        ), mock.patch.object(
+            PublishedMetadata,
+            "create_from_file",
+            metadata_timer.wrap(PublishedMetadata.create_from_file),
+        ), mock.patch.dict(
+            publishing._COMPRESSOR_FILES, compressor_files
+        ), running_task(
+            "publish"
+        ), connection.execute_wrapper(
+            query_counter
+        ):
+            start = time.perf_counter()
+            publish(self.repository_version.pk, **kwargs)
+            duration = time.perf_counter() - start
+
+        measurements = {
+            "packages": self.package_count,
+            "duration": duration,
+            "packages_per_second": self.package_count / duration,
+            "queries": query_counter.count,
+            "rendering_duration": render_timer.duration,
+            "compression_duration": compression_timer.duration,
+            "create_from_file_duration": metadata_timer.duration,
+        }
+        for name, value in measurements.items():
+            self.record_property(name, value)
+        self.assertLess(query_counter.count, self.package_count * MAX_QUERIES_PER_PACKAGE)
+        return measurements
+
+    def test_simple(self):
+        """Measure a simple publication."""
+        self._measure(simple=True)
+
+    def test_structured(self):
+        """Measure a structured publication."""
+        self._measure(structured=True)
+
+    def test_signed(self):
+        """Measure a signed structured publication."""
+        signing_service = self._create_signing_service()
+        self._measure(structured=True, signing_service_pk=signing_service.pk)
+
+    def test_structured_workers(self):
+        """
+        Measure a structured publication, whose Packages indices are written by worker processes.
+
+        The rendering and compression happen in the workers, so only the duration is comparable.
+        """
+        single = self._measure(structured=True)
+        with override_settings(PUBLISH_WORKERS=len(COMPONENTS) * len(ARCHITECTURES)):
+            parallel = self._measure(structured=True)
+        self.record_property("workers_speedup", single["duration"] / parallel["duration"])
+
+    @override_settings(PUBLISH_STANZA_CACHE_SIZE=10**6)
+    def test_structured_cached(self):
+        """Measure a structured publication, whose stanzas were cached by a previous one."""
+        # Different compressors keep the Packages indices of the first publication from being reused
+        uncached = self._measure(structured=True, compressors="xz")
+        cached = self._measure(structured=True)
+        self.assertLess(cached["rendering_duration"], uncached["rendering_duration"])
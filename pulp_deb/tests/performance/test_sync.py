@@ -0,0 +1,119 @@
+"""
+Benchmark syncing a synthetic APT repository served from a local HTTP server.
+
+These tests need a configured pulp database, run them using:
+django-admin test pulp_deb.tests.performance.test_sync
+"""
+import resource
+import tempfile
+import time
+import tracemalloc
+
+from django.db import connection
+
+from pulp_deb.app.models import AptRemote, AptRepository, Package
+from pulp_deb.app.tasks.synchronizing import DebDeclarativeVersion, DebFirstStage
+from pulp_deb.tests.performance.utils import (
+    BenchmarkTestCase,
+    QueryCounter,
+    gen_apt_repository,
+    running_task,
+    serve_directory,
+)
+
+
+RELEASES = ("stable", "testing")
+COMPONENTS = ("main", "contrib")
+ARCHITECTURES = ("amd64", "arm64")
+# The number of packages in every Packages index:
+PACKAGE_COUNT = 2000
+# Every new Package and PackageReleaseComponent is saved in its own savepoint, trying an UPDATE
+# before the INSERT into both the content and the detail table, which takes 12 queries per package.
+# Everything else is done in batches, so it must not add more than one query per package:
+MAX_QUERIES_PER_PACKAGE = 13
+# The sizes of the single Packages index synced to measure the memory usage:
+MEMORY_PACKAGE_COUNTS = (2000, 8000, 32000)
+# Packages are resolved in bounded windows, so the peak memory must grow much slower than the
+# indices do, here 16 times:
+MAX_MEMORY_GROWTH = 4
+
+
+class SyncBenchmark(BenchmarkTestCase):
+    """Measure the sync of a synthetic repository."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Generate the synthetic repository."""
+        super().setUpClass()
+        cls.repository_dir = tempfile.TemporaryDirectory()
+        cls.package_count = gen_apt_repository(
+            cls.repository_dir.name, RELEASES, COMPONENTS, ARCHITECTURES, PACKAGE_COUNT
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        """Remove the synthetic repository."""
+        cls.repository_dir.cleanup()
+        super().tearDownClass()
+
+    def test_sync(self):
+        """Record wall time, queries, peak RSS and the statistics of every stage."""
+        with serve_directory(self.repository_dir.name) as url:
+            remote = AptRemote.objects.create(
+                name="benchmark",
+                url=url,
+                distributions=" ".join(RELEASES),
+                policy=AptRemote.ON_DEMAND,
+            )
+            repository = AptRepository.objects.create(name="benchmark")
+            declarative_version = DebDeclarativeVersion(
+                DebFirstStage(remote), repository, mirror=False
+            )
+            query_counter = QueryCounter()
+            with running_task("sync benchmark"):
+                start = time.perf_counter()
+                with connection.execute_wrapper(query_counter):
+                    declarative_version.create()
+                duration = time.perf_counter() - start
+
+        self.record_property("packages", self.package_count)
+        self.record_property("duration", duration)
+        self.record_property("packages_per_second", self.package_count / duration)
+        self.record_property("queries", query_counter.count)
+        self.record_property(
+            "peak_rss_mib", resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        )
+        for statistics in declarative_version.stage_statistics:
+            self.record_property("stage", str(statistics))
+        self.assertEqual(Package.objects.count(), self.package_count)
+        self.assertLess(query_counter.count, self.package_count * MAX_QUERIES_PER_PACKAGE)
+
+
+class SyncMemoryBenchmark(BenchmarkTestCase):
+    """Measure the peak memory usage of syncing Packages indices of growing size."""
+
+    def _measure(self, package_count):
+        with tempfile.TemporaryDirectory() as repository_dir:
+            gen_apt_repository(repository_dir, ("stable",), ("main",), ("amd64",), package_count)
+            with serve_directory(repository_dir) as url:
+                name = "benchmark-{}".format(package_count)
+                remote = AptRemote.objects.create(
+                    name=name, url=url, distributions="stable", policy=AptRemote.ON_DEMAND
+                )
+                repository = AptRepository.objects.create(name=name)
+                with running_task("sync memory benchmark"):
+                    # The peak RSS of the process cannot be reset between syncs, trace allocations
+                    tracemalloc.start()
+                    DebDeclarativeVersion(DebFirstStage(remote), repository, mirror=False).create()
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+
+        packages = Package.objects.filter(pk__in=repository.latest_version().content)
+        self.assertEqual(packages.count(), package_count)
+        self.record_property("peak_memory_mib_{}".format(package_count), peak / 2**20)
+        return peak
+
+    def test_memory(self):
+        """Record the peak memory of syncing indices of growing size, it must stay bounded."""
+        peaks = [self._measure(package_count) for package_count in MEMORY_PACKAGE_COUNTS]
+        self.assertLess(peaks[-1], peaks[0] * MAX_MEMORY_GROWTH)
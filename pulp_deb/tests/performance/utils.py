@@ -0,0 +1,256 @@
+"""Utilities for the performance tests of the deb plugin."""
+import contextlib
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock
+
+from debian import deb822
+from django.test import TestCase
+from pulpcore.plugin.constants import TASK_STATES
+from pulpcore.plugin.models import Task
+
+log = logging.getLogger(__name__)
+
+
+def gen_package_paragraph(number, architecture="amd64", component="main"):
+    """
+    Generate a realistic Packages paragraph for a synthetic package.
+
+    Args:
+        number (int): Makes the package name (and thereby its checksums) unique.
+        architecture (str): The architecture of the package.
+        component (str): The component used for the pool path of the package.
+
+    Returns:
+        str: The paragraph including its terminating blank line.
+
+    """
+    name = "synthetic-package-{}".format(number)
+    version = "{}.{}-{}".format(number % 7, number % 13, number % 3 + 1)
+    filename = "pool/{}/s/{}/{}_{}_{}.deb".format(component, name, name, version, architecture)
+    digest_source = filename.encode()
+    return (
+        "Package: {name}\n"
+        "Source: {name}-source\n"
+        "Version: {version}\n"
+        "Installed-Size: {installed_size}\n"
+        "Maintainer: Synthetic Maintainers <synthetic@example.com>\n"
+        "Architecture: {architecture}\n"
+        "Depends: libc6 (>= 2.28), libsynthetic{dependency} (= {version})\n"
+        "Recommends: synthetic-recommends\n"
+        "Description: Synthetic package number {number}\n"
+        " This package was generated for the pulp_deb performance tests.\n"
+        " .\n"
+        " It spans several lines, just like real package descriptions do.\n"
+        "Homepage: https://example.com/{name}\n"
+        "Description-md5: {description_md5}\n"
+        "Tag: role::program, use::testing\n"
+        "Section: misc\n"
+        "Priority: optional\n"
+        "Filename: {filename}\n"
+        "Size: {size}\n"
+        "MD5sum: {md5}\n"
+        "SHA256: {sha256}\n"
+        "\n"
+    ).format(
+        name=name,
+        number=number,
+        version=version,
+        architecture=architecture,
+        installed_size=number % 4096 + 16,
+        dependency=number % 5,
+        description_md5=hashlib.md5(name.encode()).hexdigest(),
+        filename=filename,
+        size=number % 65536 + 1024,
+        md5=hashlib.md5(digest_source).hexdigest(),
+        sha256=hashlib.sha256(digest_source).hexdigest(),
+    )
+
+
+def gen_packages_file(count, architecture="amd64", component="main"):
+    """
+    Generate the content of a Packages file with count synthetic packages.
+
+    Returns:
+        bytes: The content of the Packages file.
+
+    """
+    return "".join(
+        gen_package_paragraph(number, architecture, component) for number in range(count)
+    ).encode()
+
+
+def gen_apt_repository(
+    path,
+    releases=("stable",),
+    components=("main",),
+    architectures=("amd64",),
+    package_count=1000,
+):
+    """
+    Generate a synthetic APT repository below path.
+
+    Every release contains a Packages index (plain and gzipped) with package_count synthetic
+    packages for each of its components and architectures. The pool files of the packages are
+    not generated, so the repository is only suitable for syncs using the on_demand policy.
+
+    Args:
+        path (str): The directory to write the repository to.
+        releases (tuple): The distributions of the repository.
+        components (tuple): The components of every release.
+        architectures (tuple): The architectures of every release.
+        package_count (int): The number of packages in every Packages index.
+
+    Returns:
+        int: The total number of packages in the repository.
+
+    """
+    number = 0
+    for release in releases:
+        release_dir = os.path.join(path, "dists", release)
+        release_file = deb822.Release()
+        release_file["Origin"] = "Synthetic"
+        release_file["Suite"] = release
+        release_file["Codename"] = release
+        release_file["Architectures"] = " ".join(architectures)
+        release_file["Components"] = " ".join(components)
+        release_file["MD5Sum"] = []
+        release_file["SHA256"] = []
+        for component in components:
+            for architecture in architectures:
+                paragraphs = [
+                    gen_package_paragraph(number + offset, architecture, component)
+                    for offset in range(package_count)
+                ]
+                number += package_count
+                packages = "".join(paragraphs).encode()
+                index_dir = os.path.join(component, "binary-{}".format(architecture))
+                os.makedirs(os.path.join(release_dir, index_dir), exist_ok=True)
+                for name, data in (
+                    ("Packages", packages),
+                    ("Packages.gz", gzip.compress(packages)),
+                ):
+                    relative_path = os.path.join(index_dir, name)
+                    with open(os.path.join(release_dir, relative_path), "wb") as index_file:
+                        index_file.write(data)
+                    for checksum_type, deb_field in (("md5", "MD5Sum"), ("sha256", "SHA256")):
+                        release_file[deb_field].append(
+                            {
+                                deb_field.lower(): hashlib.new(checksum_type, data).hexdigest(),
+                                "size": len(data),
+                                "name": relative_path,
+                            }
+                        )
+        with open(os.path.join(release_dir, "Release"), "wb") as release_fd:
+            release_file.dump(release_fd)
+    return number
+
+
+class _QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(path):
+    """
+    Serve a directory from a local HTTP server running in a background thread.
+
+    Args:
+        path (str): The directory to serve.
+
+    Yields:
+        str: The base url of the served directory, ending with a slash.
+
+    """
+    handler = functools.partial(_QuietHTTPRequestHandler, directory=path)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting the issued queries.
+
+    Use it with django.db.connection.execute_wrapper().
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        """Count and execute a query."""
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class Timer:
+    """Accumulate the time spent in wrapped functions."""
+
+    def __init__(self):
+        self.duration = 0.0
+
+    def wrap(self, function):
+        """Return a wrapper of function that adds the time spent in it to self.duration."""
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.duration += time.perf_counter() - start
+
+        return wrapper
+
+
+@contextlib.contextmanager
+def running_task(name):
+    """
+    Run the enclosed code as part of a running Task, just like a worker runs a task.
+
+    ProgressReports and CreatedResources belong to the current Task, which pulpcore looks up using
+    the PULP_TASK_ID environment variable or the current rq job, depending on the worker type.
+
+    Args:
+        name (str): The name of the Task.
+
+    Yields:
+        pulpcore.plugin.models.Task: The running Task.
+
+    """
+    task = Task.objects.create(state=TASK_STATES.RUNNING, name=name)
+    job = SimpleNamespace(id=str(task.pk))
+    with mock.patch.dict(os.environ, {"PULP_TASK_ID": str(task.pk)}), mock.patch(
+        "pulpcore.app.models.task.get_current_job", return_value=job
+    ):
+        yield task
+
+
+class BenchmarkTestCase(TestCase):
+    """
+    Base class of the benchmarks, reporting their measurements using record_property.
+
+    When the benchmarks are run using pytest, the record_property fixture is set up by the
+    conftest.py of this package, so the measurements end up in the junitxml report. Otherwise they
+    are logged.
+    """
+
+    def record_property(self, name, value):
+        """Report a measurement."""
+        log.info("%s: %s = %s", self.id(), name, value)
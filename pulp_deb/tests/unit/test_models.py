@@ -1,8 +1,15 @@
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import TestCase
 
 from pulpcore.plugin.models import Artifact, ContentArtifact
-from pulp_deb.app.models import Package
+from pulp_deb.app.models import (
+    AptPublication,
+    Package,
+    PackageReleaseComponent,
+    Release,
+    ReleaseComponent,
+)
 from pulp_deb.app.serializers import Package822Serializer
 
 
@@ -79,3 +86,64 @@ class TestPackage(TestCase):
             Package822Serializer(self.package1, context={"request": None}).to822().dump(),
             self.PACKAGE_PARAGRAPH,
         )
+
+    def test_model_to822_annotated(self):
+        """Test dump of a package annotated with its artifact checksums uses no queries."""
+        package = Package822Serializer.annotate_artifacts(Package.objects.all()).get()
+        with self.assertNumQueries(0):
+            paragraph = Package822Serializer.model_to822(package).dump()
+        self.assertEqual(paragraph, self.PACKAGE_PARAGRAPH)
+        self.assertEqual(package.content_artifact_pk, self.package1.contentartifact_set.get().pk)
+
+
+class TestAptPublication(TestCase):
+    """Test AptPublication model."""
+
+    def test_parse_compressors(self):
+        """Test parsing of Packages index compressors."""
+        self.assertEqual(AptPublication.parse_compressors(""), {})
+        self.assertEqual(AptPublication.parse_compressors("gz"), {"gz": 9})
+        self.assertEqual(AptPublication.parse_compressors("xz:9  bz2"), {"xz": 9, "bz2": 9})
+
+    def test_parse_invalid_compressors(self):
+        """Test that unsupported compressors and levels are rejected."""
+        for compressors in ("zstd", "gz:0", "xz:fast"):
+            with self.assertRaises(ValueError):
+                AptPublication.parse_compressors(compressors)
+
+
+class TestIndexes(TestCase):
+    """Test that the hot package lookups of sync, publish and the package filter use indexes."""
+
+    def setUp(self):
+        """Disable sequential scans, which the planner prefers for small tables."""
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+
+    def tearDown(self):
+        """Enable sequential scans again."""
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = on")
+
+    def test_package_version_architecture(self):
+        """Test looking up packages by their repo_key_fields."""
+        plan = Package.objects.filter(
+            package="aegir", version="0.1-edda0", architecture="sea"
+        ).explain()
+        self.assertIn("deb_package_package_336214_idx", plan)
+
+    def test_sha256(self):
+        """Test looking up packages by their sha256."""
+        plan = Package.objects.filter(sha256="eeff").explain()
+        self.assertIn("deb_package_sha256_1fc3e1_idx", plan)
+
+    def test_release_component_packages(self):
+        """Test looking up the packages of a release component by its foreign key index."""
+        release = Release.objects.create(codename="ragnarok", suite="stable", distribution="stable")
+        release_component = ReleaseComponent.objects.create(component="main", release=release)
+        plan = (
+            PackageReleaseComponent.objects.filter(release_component=release_component)
+            .values_list("package_id", flat=True)
+            .explain()
+        )
+        self.assertNotIn("Seq Scan", plan)
@@ -0,0 +1,152 @@
+import gzip
+import os
+import pickle
+import tempfile
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from pulp_deb.app.models import Package, PackageStanza
+from pulp_deb.app.tasks.publishing import (
+    STANZA_FORMAT_VERSION,
+    _StanzaCache,
+    _unpickle_all,
+    _write_package_index,
+)
+
+
+class TestStanzaCache(TestCase):
+    """Test the cache of rendered Packages stanzas."""
+
+    COMPONENT = "asgard"
+
+    def setUp(self):
+        """Create packages annotated like the ones of a publication."""
+        self.packages = []
+        for version in ("1.0", "2.0", "3.0"):
+            package = Package(
+                package="frigg",
+                version=version,
+                architecture="all",
+                maintainer="Odin",
+                description="Goddess.",
+                relative_path="frigg_{}_all.deb".format(version),
+                sha256=version,
+            )
+            package.save()
+            package.artifact_md5 = "md5-" + version
+            package.artifact_sha1 = "sha1-" + version
+            package.artifact_sha256 = "sha256-" + version
+            self.packages.append(package)
+        self.cache = _StanzaCache(2)
+
+    def store(self, package, format_version=STANZA_FORMAT_VERSION):
+        """Store a stanza for a package."""
+        stanza = PackageStanza(
+            package=package,
+            component=self.COMPONENT,
+            format_version=format_version,
+            checksums=_StanzaCache.checksums(package),
+            stanza="Package: {}\n".format(package.version),
+        )
+        self.cache.store([stanza])
+        return PackageStanza.objects.get(pk=stanza.pk)
+
+    def lookup(self, packages, component=COMPONENT):
+        """Return the cached stanzas of the packages."""
+        return [package.cached_stanza for package in self.cache.lookup(packages, component)]
+
+    def test_miss(self):
+        """Test that packages without a stored stanza are not cached."""
+        self.store(self.packages[0])
+        self.assertEqual(self.lookup(self.packages[1:]), [None, None])
+        self.assertEqual(self.lookup(self.packages[:1], "midgard"), [None])
+
+    def test_hit(self):
+        """Test that stored stanzas are found and touched."""
+        stored = self.store(self.packages[0])
+        self.assertEqual(self.lookup(self.packages[:2]), ["Package: 1.0\n", None])
+        self.assertGreater(
+            PackageStanza.objects.get(pk=stored.pk).pulp_last_updated, stored.pulp_last_updated
+        )
+
+    def test_checksums_changed(self):
+        """Test that a stanza is not used once the artifact checksums of its package change."""
+        self.store(self.packages[0])
+        self.packages[0].artifact_sha256 = "changed"
+        self.assertEqual(self.lookup(self.packages[:1]), [None])
+
+    def test_format_version_changed(self):
+        """Test that stanzas rendered by another version of the rendering are not used."""
+        self.store(self.packages[0], format_version=STANZA_FORMAT_VERSION - 1)
+        self.assertEqual(self.lookup(self.packages[:1]), [None])
+
+    def test_evict(self):
+        """Test that the least recently used stanzas are evicted."""
+        now = datetime.now(tz=timezone.utc)
+        for age, package in zip((3, 2, 1), self.packages):
+            with patch("django.utils.timezone.now", return_value=now - timedelta(minutes=age)):
+                self.store(package)
+        # Using the oldest stanza makes the second one the least recently used
+        self.lookup(self.packages[:1])
+
+        self.cache.evict()
+
+        self.assertEqual(
+            set(PackageStanza.objects.values_list("package__version", flat=True)), {"1.0", "3.0"}
+        )
+
+
+class TestWritePackageIndex(TestCase):
+    """Test writing a Packages index from spooled packages, like a worker process does."""
+
+    def setUp(self):
+        """Spool a package with and one without a cached stanza."""
+        self.working_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.working_dir.cleanup)
+        self.packages = []
+        for version in ("1.0", "2.0"):
+            package = Package(
+                package="frigg",
+                version=version,
+                architecture="all",
+                maintainer="Odin",
+                description="Goddess.",
+                relative_path="frigg_{}_all.deb".format(version),
+                sha256=version,
+            )
+            package.artifact_md5 = "md5-" + version
+            package.artifact_sha1 = "sha1-" + version
+            package.artifact_sha256 = "sha256-" + version
+            package.stanza_checksums = "checksums-" + version
+            package.cached_stanza = None
+            self.packages.append(package)
+        self.packages[0].cached_stanza = "Package: frigg\nVersion: 1.0\n"
+        self.packages_path = os.path.join(self.working_dir.name, "packages")
+        with open(self.packages_path, "wb") as packages_file:
+            for package in self.packages:
+                pickle.dump(package, packages_file)
+
+    def test_write(self):
+        """Test that uncached stanzas are rendered and returned, and all variants are written."""
+        package_index_path = os.path.join(self.working_dir.name, "Packages")
+        stanzas_path = os.path.join(self.working_dir.name, "stanzas")
+
+        paths = _write_package_index(
+            package_index_path, {"gz": 9}, "asgard", self.packages_path, stanzas_path
+        )
+
+        self.assertEqual(paths, [package_index_path, package_index_path + ".gz"])
+        with open(package_index_path, "rb") as package_index_file:
+            package_index = package_index_file.read()
+        with gzip.open(package_index_path + ".gz") as package_index_file:
+            self.assertEqual(package_index_file.read(), package_index)
+        paragraphs = package_index.decode().split("\n\n")
+        self.assertEqual(paragraphs[0], "Package: frigg\nVersion: 1.0")
+        self.assertIn("SHA256: sha256-2.0\n", paragraphs[1])
+        self.assertTrue(paragraphs[1].endswith("\nFilename: pool/asgard/f/frigg/frigg_2.0_all.deb"))
+        with open(stanzas_path, "rb") as stanzas_file:
+            stanzas = list(_unpickle_all(stanzas_file))
+        self.assertEqual(stanzas, [(self.packages[1].pk, "checksums-2.0", paragraphs[1] + "\n")])
+        self.assertFalse(os.path.exists(self.packages_path))
@@ -1,6 +1,58 @@
-from django.test import TestCase
+import aiohttp
+import asyncio
+import gzip
+import hashlib
+import io
+import lzma
+import os
+import tempfile
+from unittest.mock import patch
 
-from pulp_deb.app.tasks.synchronizing import _filter_split_architectures, _filter_split_components
+from django.test import TestCase, override_settings
+
+from pulpcore.plugin.exceptions import DigestValidationError
+from pulpcore.plugin.models import Artifact
+from pulpcore.plugin.stages import (
+    DeclarativeArtifact,
+    DeclarativeContent,
+    Stage,
+)
+
+from pulp_deb.app.constants import GPG_KEYRING_CACHE_SIZE
+from pulp_deb.app.downloaders import DecompressingHttpDownloader
+from pulp_deb.app.models import (
+    AptRemote,
+    AptRepository,
+    Package,
+    PackageIndex,
+    PackageReleaseComponent,
+    Release,
+    ReleaseComponent,
+    ReleaseFile,
+)
+from pulp_deb.app.tasks.synchronizing import (
+    DebFirstStage,
+    DeclarativePackageIndexArtifact,
+    PackageIndexStream,
+    _ConcurrencyLimit,
+    _add_uncompressed_artifact,
+    _apply_ed_scripts,
+    _evict_keyrings,
+    _filter_split_architectures,
+    _filter_split_components,
+    _get_keyring,
+    _get_or_create_package_release_components,
+    _measure_stage,
+    _optimizable_version,
+    _package_index_chunks,
+    _package_index_paths,
+    _parse_package_index,
+    _parse_package_index_chunk,
+    _parse_pdiff_index,
+    _pdiff_patch_names,
+    _record_sync,
+    _spooled_records,
+)
 
 
 class TestArchitectureFiltering(TestCase):
@@ -189,3 +241,942 @@ class TestComponentFiltering(TestCase):
 
             self.assertEqual(len(captured.records), 3)
             self.assertEqual(captured.records[0].getMessage(), expected_log_message)
+
+
+class TestPackageIndexParsing(TestCase):
+    """
+    Tests the fast path parsing of Packages files done by the _parse_package_index function.
+    """
+
+    PACKAGES_FILE = (
+        b"Package: aegir\n"
+        b"Version: 0.1-edda0\n"
+        b"Architecture: sea\n"
+        b"Essential: yes\n"
+        b"Maintainer: Utgardloki\n"
+        b"Description: A sea j\xc3\xb6tunn.\n"
+        b" Associated with the ocean.\n"
+        b" .\n"
+        b" Hosts the feasts of the gods.\n"
+        b"X-Unknown-Field: ignored\n"
+        b" also ignored\n"
+        b"Depends:\n"
+        b" ran,\n"
+        b" kvasir\n"
+        b"Filename: ./pool/a/aegir/aegir_0.1-edda0_sea.deb\n"
+        b"MD5sum: aabb\n"
+        b"SHA256: eeff\n"
+        b"\n"
+        b"\n"
+        b"Package: ran\n"
+        b"Version: 0.1-edda0\n"
+        b"Architecture: sea\n"
+        b"Maintainer: Utgardloki\n"
+        b"Description: Missing a filename.\n"
+        b"SHA256: 0011\n"
+        b"\n"
+        b"Package: kvasir\n"
+        b"Version: 0.1-edda0\n"
+        b"Architecture: all\n"
+        b"Maintainer: Aesir\n"
+        b"Description: Crafted from saliva.\n"
+        b"Filename: pool/k/kvasir/kvasir_0.1-edda0_all.deb\n"
+        b"SHA256: 2233\n"
+    )
+
+    def test_parse_package_index(self):
+        """
+        Test that fields are translated like the Package822Serializer would translate them.
+        """
+        with self.assertLogs(level="WARNING") as captured:
+            records = list(_parse_package_index(io.BytesIO(self.PACKAGES_FILE)))
+        self.assertEqual(len(captured.records), 1)
+        self.assertEqual(len(records), 2)
+
+        package_fields, checksums = records[0]
+        self.assertEqual(
+            package_fields,
+            {
+                "package": "aegir",
+                "version": "0.1-edda0",
+                "architecture": "sea",
+                "essential": True,
+                "maintainer": "Utgardloki",
+                "description": "A sea jötunn.\n Associated with the ocean.\n .\n Hosts the feasts "
+                "of the gods.",
+                "depends": "ran,\n kvasir",
+                "relative_path": "pool/a/aegir/aegir_0.1-edda0_sea.deb",
+                "sha256": "eeff",
+            },
+        )
+        self.assertEqual(checksums, {"MD5sum": "aabb", "SHA256": "eeff"})
+
+        package_fields, checksums = records[1]
+        self.assertEqual(package_fields["package"], "kvasir")
+        self.assertEqual(checksums, {"SHA256": "2233"})
+
+    def test_parse_package_index_chunks(self):
+        """
+        Test that chunks consist of whole paragraphs and parse like the whole file.
+        """
+        chunks = list(_package_index_chunks(io.BytesIO(self.PACKAGES_FILE), size=64))
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), self.PACKAGES_FILE)
+        for chunk in chunks[:-1]:
+            self.assertTrue(chunk.endswith(b"\n\n"))
+        with self.assertLogs(level="WARNING"):
+            records = [record for chunk in chunks for record in _parse_package_index_chunk(chunk)]
+        with self.assertLogs(level="WARNING"):
+            self.assertEqual(records, list(_parse_package_index(io.BytesIO(self.PACKAGES_FILE))))
+
+    def test_parse_package_index_known_packages(self):
+        """
+        Test that the paragraphs of known packages are not converted.
+        """
+        known_packages = {("pool/a/aegir/aegir_0.1-edda0_sea.deb", "eeff")}
+        with self.assertLogs(level="WARNING"):
+            records = list(_parse_package_index(io.BytesIO(self.PACKAGES_FILE), known_packages))
+        self.assertEqual(len(records), 2)
+        self.assertEqual(
+            records[0],
+            ({"relative_path": "pool/a/aegir/aegir_0.1-edda0_sea.deb", "sha256": "eeff"}, None),
+        )
+        package_fields, checksums = records[1]
+        self.assertEqual(package_fields["package"], "kvasir")
+        self.assertEqual(checksums, {"SHA256": "2233"})
+
+
+class TestDecompressingDownloader(TestCase):
+    """
+    Tests that package indices are decompressed and validated while they are downloaded.
+    """
+
+    PACKAGES = b"".join(b"Package: god%d\nVersion: 1.0\n\n" % n for n in range(100))
+    PACKAGES_SHA256 = hashlib.sha256(PACKAGES).hexdigest()
+
+    def setUp(self):
+        """Download into a temporary working directory."""
+        self.cwd = os.getcwd()
+        self.working_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.working_dir.name)
+
+    def tearDown(self):
+        """Remove the temporary working directory."""
+        os.chdir(self.cwd)
+        self.working_dir.cleanup()
+
+    async def _download(self, extension, data, expected_sha256, stream=None, decompress=True):
+        async with aiohttp.ClientSession() as session:
+            downloader = DecompressingHttpDownloader(
+                "http://example.com/dists/ragnarok/asgard/binary-ppc64/Packages" + extension,
+                session=session,
+                decompress=decompress,
+                expected_uncompressed_digests={"sha256": expected_sha256}
+                if expected_sha256
+                else None,
+                uncompressed_stream=stream,
+            )
+            try:
+                for start in range(0, len(data), 100):
+                    await downloader.handle_data(data[start : start + 100])
+                    await asyncio.sleep(0)
+                await downloader.finalize()
+            except Exception as e:
+                if stream:
+                    stream.finish(error=e)
+                raise
+        if stream:
+            stream.finish()
+        return downloader
+
+    def _run(self, coroutine):
+        return asyncio.get_event_loop().run_until_complete(coroutine)
+
+    def _assert_uncompressed(self, downloader):
+        attributes = downloader.uncompressed_artifact_attributes
+        self.assertEqual(attributes["sha256"], self.PACKAGES_SHA256)
+        self.assertEqual(attributes["size"], len(self.PACKAGES))
+        with open(downloader.uncompressed_path, "rb") as uncompressed_file:
+            self.assertEqual(uncompressed_file.read(), self.PACKAGES)
+
+    def test_gz(self):
+        """
+        Test that a gz compressed package index is decompressed and hashed.
+        """
+        data = gzip.compress(self.PACKAGES)
+        downloader = self._run(self._download(".gz", data, self.PACKAGES_SHA256))
+        self.assertEqual(downloader.artifact_attributes["size"], len(data))
+        self._assert_uncompressed(downloader)
+
+    def test_xz(self):
+        """
+        Test that a xz compressed package index is decompressed and hashed.
+        """
+        data = lzma.compress(self.PACKAGES)
+        downloader = self._run(self._download(".xz", data, self.PACKAGES_SHA256))
+        self.assertEqual(downloader.artifact_attributes["size"], len(data))
+        self._assert_uncompressed(downloader)
+
+    def test_unknown_digest(self):
+        """
+        Test that the uncompressed digest is computed, if the Release file does not list it.
+        """
+        data = lzma.compress(self.PACKAGES)
+        downloader = self._run(self._download(".xz", data, None))
+        self._assert_uncompressed(downloader)
+
+    def test_not_decompressed(self):
+        """
+        Test that other files of the remote are downloaded like by the HttpDownloader.
+        """
+        data = lzma.compress(self.PACKAGES)
+        downloader = self._run(self._download(".deb", data, None, decompress=False))
+        self.assertEqual(downloader.artifact_attributes["size"], len(data))
+        self.assertIsNone(downloader.uncompressed_path)
+        self.assertIsNone(downloader.uncompressed_artifact_attributes)
+
+    def test_digest_mismatch(self):
+        """
+        Test that a mismatch of the uncompressed digest fails the download.
+        """
+        for extension, compress in ((".gz", gzip.compress), (".xz", lzma.compress)):
+            with self.assertRaises(DigestValidationError):
+                self._run(self._download(extension, compress(self.PACKAGES), "0" * 64))
+
+    def test_stream(self):
+        """
+        Test that the uncompressed data is read in whole paragraphs while it is downloaded.
+        """
+        stream = PackageIndexStream()
+
+        async def read():
+            self.assertTrue(await stream.wait_started())
+            return [chunk async for chunk in stream.chunks(size=64)]
+
+        chunks, downloader = self._run(
+            asyncio.gather(
+                read(),
+                self._download(".xz", lzma.compress(self.PACKAGES), self.PACKAGES_SHA256, stream),
+            )
+        )
+        self._assert_uncompressed(downloader)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(b"".join(chunks), self.PACKAGES)
+        for chunk in chunks:
+            self.assertTrue(chunk.endswith(b"\n\n"))
+
+    def test_stream_digest_mismatch(self):
+        """
+        Test that reading the uncompressed data fails, if the download fails.
+        """
+        stream = PackageIndexStream()
+
+        async def read():
+            self.assertTrue(await stream.wait_started())
+            return [chunk async for chunk in stream.chunks(size=64)]
+
+        with self.assertRaises(DigestValidationError):
+            self._run(
+                asyncio.gather(
+                    read(), self._download(".gz", gzip.compress(self.PACKAGES), "0" * 64, stream)
+                )
+            )
+
+    def _spool(self, expected_sha256):
+        first_stage = DebFirstStage(AptRemote(name="asgard", url="http://example.com/"))
+        packages = b"".join(
+            b"Package: god%d\nVersion: 1.0\nArchitecture: all\nMaintainer: Odin\n"
+            b"Description: A god.\nFilename: pool/god%d.deb\nSHA256: %d\n\n" % (n, n, n)
+            for n in range(100)
+        )
+        stream = PackageIndexStream()
+
+        async def spool():
+            self.assertTrue(await stream.wait_started())
+            return await first_stage._spool_package_index_records(stream, {})
+
+        records_file, download = self._run(
+            asyncio.gather(
+                spool(),
+                self._download(".xz", lzma.compress(packages), expected_sha256, stream),
+                return_exceptions=True,
+            )
+        )
+        return packages, records_file, download
+
+    def test_spool(self):
+        """
+        Test that the records parsed while downloading are held back until the download finished.
+        """
+        packages, records_file, _downloader = self._spool(None)
+        with records_file:
+            records = list(_spooled_records(records_file))
+        self.assertEqual(records, list(_parse_package_index(io.BytesIO(packages))))
+
+    def test_spool_digest_mismatch(self):
+        """
+        Test that the records parsed while downloading are discarded, if the download fails.
+        """
+        _packages, records_file, error = self._spool("0" * 64)
+        self.assertIsInstance(error, DigestValidationError)
+        self.assertIsNone(records_file)
+
+    def test_stream_not_downloaded(self):
+        """
+        Test that a stream, that is finished without a download, can not be read.
+        """
+        stream = PackageIndexStream()
+        stream.finish()
+        self.assertFalse(self._run(stream.wait_started()))
+
+
+class TestPackageIndexVariants(TestCase):
+    """
+    Tests the choice of the Packages index variants to download.
+    """
+
+    def _paths(self, preference, filenames):
+        file_references = {
+            os.path.join("asgard/binary-ppc64", filename): {"SHA256": "eeff", "Size": "1"}
+            for filename in filenames
+        }
+        return [
+            os.path.basename(path)
+            for path in _package_index_paths("asgard/binary-ppc64", preference, file_references)
+        ]
+
+    def test_preference(self):
+        """
+        Test that the listed variants are ordered by preference.
+        """
+        filenames = ["Packages", "Packages.gz", "Packages.xz"]
+        self.assertEqual(
+            self._paths("xz gz bz2 plain", filenames), ["Packages.xz", "Packages.gz", "Packages"]
+        )
+        self.assertEqual(
+            self._paths("gz plain", filenames), ["Packages.gz", "Packages", "Packages.xz"]
+        )
+
+    def test_not_preferred(self):
+        """
+        Test that listed variants missing from the preference are used nonetheless.
+        """
+        self.assertEqual(self._paths("plain", ["Packages.xz", "Release"]), ["Packages.xz"])
+
+    def test_none_listed(self):
+        """
+        Test that no variant is used, if none is listed.
+        """
+        self.assertEqual(self._paths("xz gz bz2 plain", ["Release"]), [])
+
+    def test_deferred(self):
+        """
+        Test that the compressed variants, that are not downloaded, are declared as deferred.
+        """
+        first_stage = DebFirstStage(AptRemote(name="asgard", url="http://example.com/debian/"))
+        paths = ["asgard/binary-ppc64/Packages", "asgard/binary-ppc64/Packages.gz"]
+        file_references = {path: {"SHA256": "eeff", "Size": "1"} for path in paths}
+        d_artifacts = first_stage._to_deferred_package_index_d_artifacts(
+            "dists/ragnarok", paths, file_references
+        )
+        self.assertEqual(len(d_artifacts), 1)
+        self.assertTrue(d_artifacts[0].deferred_download)
+        self.assertEqual(
+            d_artifacts[0].relative_path, "dists/ragnarok/asgard/binary-ppc64/Packages.gz"
+        )
+        self.assertEqual(
+            d_artifacts[0].url,
+            "http://example.com/debian/dists/ragnarok/asgard/binary-ppc64/Packages.gz",
+        )
+        self.assertEqual(d_artifacts[0].artifact.sha256, "eeff")
+
+
+class TestUncompressedArtifact(TestCase):
+    """
+    Tests that the uncompressed artifact of a PackageIndex is available after the download.
+    """
+
+    PACKAGES = b"Package: frigg\nVersion: 1.0\n\n"
+    RELATIVE_PATH = "dists/ragnarok/asgard/binary-ppc64/Packages"
+
+    def setUp(self):
+        """Write the package index to a temporary working directory."""
+        self.cwd = os.getcwd()
+        self.working_dir = tempfile.TemporaryDirectory()
+        os.chdir(self.working_dir.name)
+        with open("Packages.xz", "wb") as compressed_file:
+            compressed_file.write(lzma.compress(self.PACKAGES))
+        with open("Packages", "wb") as uncompressed_file:
+            uncompressed_file.write(self.PACKAGES)
+
+    def tearDown(self):
+        """Remove the temporary working directory."""
+        os.chdir(self.cwd)
+        self.working_dir.cleanup()
+
+    def _d_content(self, sha256, uncompressed_artifact=None):
+        d_artifact = DeclarativePackageIndexArtifact(
+            Artifact.init_and_validate("Packages.xz"),
+            "http://example.com/" + self.RELATIVE_PATH + ".xz",
+            self.RELATIVE_PATH + ".xz",
+            uncompressed_sha256=sha256,
+        )
+        d_artifact.uncompressed_artifact = uncompressed_artifact
+        package_index = PackageIndex(
+            release=ReleaseFile(distribution="ragnarok"),
+            component="asgard",
+            architecture="ppc64",
+            relative_path=self.RELATIVE_PATH,
+            sha256=sha256,
+        )
+        return DeclarativeContent(content=package_index, d_artifacts=[d_artifact])
+
+    def _assert_uncompressed(self, d_content):
+        sha256 = hashlib.sha256(self.PACKAGES).hexdigest()
+        self.assertEqual(d_content.content.sha256, sha256)
+        self.assertEqual(len(d_content.d_artifacts), 2)
+        self.assertEqual(d_content.d_artifacts[1].artifact.sha256, sha256)
+        self.assertEqual(d_content.d_artifacts[1].relative_path, self.RELATIVE_PATH)
+
+    def test_only_xz_listed(self):
+        """
+        Test that the sha256 of a Packages.xz only index is the one of the uncompressed data.
+        """
+        d_content = self._d_content(None, Artifact.init_and_validate("Packages"))
+        _add_uncompressed_artifact(d_content)
+        self._assert_uncompressed(d_content)
+
+    def test_only_xz_listed_not_downloaded(self):
+        """
+        Test that an existing Packages.xz only index is uncompressed to get its sha256.
+        """
+        d_content = self._d_content(None)
+        _add_uncompressed_artifact(d_content)
+        self._assert_uncompressed(d_content)
+
+    def test_listed(self):
+        """
+        Test that the uncompressed artifact is validated against the listed sha256.
+        """
+        d_content = self._d_content(hashlib.sha256(self.PACKAGES).hexdigest())
+        _add_uncompressed_artifact(d_content)
+        self._assert_uncompressed(d_content)
+
+    def test_deferred_variants(self):
+        """
+        Test that variants with a deferred download are not uncompressed or used as main artifact.
+        """
+        d_content = self._d_content(
+            hashlib.sha256(self.PACKAGES).hexdigest(), Artifact.init_and_validate("Packages")
+        )
+        d_content.d_artifacts.insert(
+            0,
+            DeclarativeArtifact(
+                Artifact(sha256=hashlib.sha256(self.PACKAGES).hexdigest()),
+                "http://example.com/" + self.RELATIVE_PATH + ".gz",
+                self.RELATIVE_PATH + ".gz",
+                None,
+                deferred_download=True,
+            ),
+        )
+        _add_uncompressed_artifact(d_content)
+        self.assertEqual(len(d_content.d_artifacts), 3)
+        self.assertEqual(d_content.d_artifacts[2].relative_path, self.RELATIVE_PATH)
+        self.assertFalse(d_content.d_artifacts[2].deferred_download)
+
+    def test_listed_mismatch(self):
+        """
+        Test that an uncompressed artifact not matching the listed sha256 is rejected.
+        """
+        d_content = self._d_content("0" * 64)
+        with self.assertRaises(DigestValidationError):
+            _add_uncompressed_artifact(d_content)
+
+
+class TestPackageReleaseComponentCreation(TestCase):
+    """
+    Tests the bulk creation of PackageReleaseComponents during sync.
+    """
+
+    def setUp(self):
+        """Setup database fixtures."""
+        release = Release(codename="ragnarok", suite="stable", distribution="ragnarok")
+        release.save()
+        self.release_component = ReleaseComponent(component="asgard", release=release)
+        self.release_component.save()
+        self.packages = []
+        for name in ("frigg", "odin", "thor"):
+            package = Package(
+                package=name,
+                version="1.0",
+                architecture="all",
+                maintainer="Asgard",
+                description="A god.",
+            )
+            package.save()
+            self.packages.append(package)
+        PackageReleaseComponent(
+            package=self.packages[0], release_component=self.release_component
+        ).save()
+
+    def test_get_or_create(self):
+        """
+        Test that only missing PackageReleaseComponents are created and all of them returned.
+        """
+        package_release_components = _get_or_create_package_release_components(
+            self.packages + self.packages[1:2], self.release_component
+        )
+        self.assertEqual(
+            sorted(prc.package.package for prc in package_release_components),
+            ["frigg", "odin", "thor"],
+        )
+        self.assertFalse(any(prc._state.adding for prc in package_release_components))
+        self.assertEqual(PackageReleaseComponent.objects.count(), 3)
+
+    def test_created_concurrently(self):
+        """
+        Test that PackageReleaseComponents created after the lookup are fetched instead.
+        """
+        existing = PackageReleaseComponent.objects.get(package=self.packages[0])
+        with patch.object(PackageReleaseComponent.objects, "filter", return_value=[]):
+            package_release_components = _get_or_create_package_release_components(
+                self.packages, self.release_component
+            )
+        self.assertIn(existing, package_release_components)
+        self.assertEqual(len(package_release_components), 3)
+        self.assertFalse(any(prc._state.adding for prc in package_release_components))
+        self.assertEqual(PackageReleaseComponent.objects.count(), 3)
+
+
+class TestKeyringCache(TestCase):
+    """
+    Tests that the cached GPG keyrings are bounded, evicting the least recently used ones.
+    """
+
+    def setUp(self):
+        """Use a temporary working directory."""
+        self.working_directory = tempfile.TemporaryDirectory()
+        self.settings = override_settings(WORKING_DIRECTORY=self.working_directory.name)
+        self.settings.enable()
+        self.keyrings_dir = os.path.join(self.working_directory.name, "deb-gpg-keyrings")
+
+    def tearDown(self):
+        """Remove the temporary working directory."""
+        self.settings.disable()
+        self.working_directory.cleanup()
+
+    def _add_keyring(self, name, mtime):
+        gnupghome = os.path.join(self.keyrings_dir, name)
+        os.makedirs(gnupghome)
+        os.utime(gnupghome, (mtime, mtime))
+        return gnupghome
+
+    def test_hit(self):
+        """
+        Test that a cached keyring is used and marked as recently used.
+        """
+        gpgkey = "Asgard key material"
+        gnupghome = self._add_keyring(hashlib.sha256(gpgkey.encode()).hexdigest(), 0)
+        gpg = _get_keyring(gpgkey)
+        self.assertEqual(gpg.gnupghome, gnupghome)
+        self.assertGreater(os.stat(gnupghome).st_mtime, 0)
+
+    def test_eviction(self):
+        """
+        Test that only the most recently used keyrings are kept.
+        """
+        for i in range(GPG_KEYRING_CACHE_SIZE + 2):
+            self._add_keyring("keyring-{:02}".format(i), 1000 + i)
+        _evict_keyrings(self.keyrings_dir)
+        self.assertEqual(
+            sorted(os.listdir(self.keyrings_dir)),
+            ["keyring-{:02}".format(i) for i in range(2, GPG_KEYRING_CACHE_SIZE + 2)],
+        )
+
+    def test_no_eviction(self):
+        """
+        Test that no keyring is removed as long as the cache is not full.
+        """
+        for i in range(GPG_KEYRING_CACHE_SIZE):
+            self._add_keyring("keyring-{:02}".format(i), 1000 + i)
+        _evict_keyrings(self.keyrings_dir)
+        self.assertEqual(len(os.listdir(self.keyrings_dir)), GPG_KEYRING_CACHE_SIZE)
+
+
+class TestOptimizableVersion(TestCase):
+    """
+    Tests that an optimized sync only carries over packages from a version synced the same way.
+    """
+
+    def setUp(self):
+        """Setup a repository version synced from a remote."""
+        self.remote = AptRemote.objects.create(
+            name="asgard", url="http://example.com/debian", distributions="ragnarok"
+        )
+        self.repository = AptRepository.objects.create(name="asgard")
+        self._add_version("ragnarok")
+        _record_sync(self.repository, self.remote, True)
+
+    def _add_version(self, distribution):
+        release = Release.objects.create(
+            codename=distribution, suite="stable", distribution=distribution
+        )
+        with self.repository.new_version() as new_version:
+            new_version.add_content(Release.objects.filter(pk=release.pk))
+
+    def test_unchanged(self):
+        """
+        Test that the latest version is used, if it was synced from the same remote and mirror.
+        """
+        self.assertEqual(
+            _optimizable_version(self.repository, self.remote, True),
+            self.repository.latest_version(),
+        )
+
+    def test_changed_remote(self):
+        """
+        Test that the latest version is not used, if the remote was changed since the sync.
+        """
+        self.remote.url = "http://example.com/ubuntu"
+        self.remote.save()
+        self.assertIsNone(_optimizable_version(self.repository, self.remote, True))
+
+    def test_other_remote(self):
+        """
+        Test that the latest version is not used, if it was synced from another remote.
+        """
+        remote = AptRemote.objects.create(
+            name="vanaheim", url="http://example.com/debian", distributions="ragnarok"
+        )
+        self.assertIsNone(_optimizable_version(self.repository, remote, True))
+
+    def test_other_mirror(self):
+        """
+        Test that the latest version is not used, if it was synced with another mirror setting.
+        """
+        self.assertIsNone(_optimizable_version(self.repository, self.remote, False))
+
+    def test_modified(self):
+        """
+        Test that the latest version is not used, if it is not the synced version.
+        """
+        self._add_version("nosuite")
+        self.assertIsNone(_optimizable_version(self.repository, self.remote, True))
+
+
+class TestCarryOver(TestCase):
+    """
+    Tests that unchanged content of the latest version is carried over by primary key.
+    """
+
+    def setUp(self):
+        """Setup a repository version containing packages of several architectures."""
+        remote = AptRemote.objects.create(
+            name="asgard", url="http://example.com/debian", distributions="ragnarok"
+        )
+        repository = AptRepository.objects.create(name="asgard")
+        release_file = ReleaseFile.objects.create(
+            codename="ragnarok",
+            suite="stable",
+            distribution="ragnarok",
+            relative_path="dists/ragnarok/Release",
+            sha256="eeff",
+        )
+        self.release_component = ReleaseComponent.objects.create(
+            component="asgard",
+            release=Release.objects.create(
+                codename="ragnarok", suite="stable", distribution="ragnarok"
+            ),
+        )
+        self.package_index = PackageIndex.objects.create(
+            release=release_file,
+            component="asgard",
+            architecture="ppc64",
+            relative_path="dists/ragnarok/asgard/binary-ppc64/Packages",
+            sha256="eeff",
+        )
+        self.package_release_components = {}
+        for name, architecture in (("frigg", "ppc64"), ("odin", "all"), ("thor", "amd64")):
+            package = Package.objects.create(
+                package=name,
+                version="1.0",
+                architecture=architecture,
+                maintainer="Asgard",
+                description="A god.",
+                relative_path="pool/{}.deb".format(name),
+                sha256=name,
+            )
+            self.package_release_components[name] = PackageReleaseComponent.objects.create(
+                package=package, release_component=self.release_component
+            )
+        with repository.new_version() as new_version:
+            new_version.add_content(PackageIndex.objects.filter(pk=self.package_index.pk))
+            new_version.add_content(PackageReleaseComponent.objects.all())
+            new_version.add_content(Package.objects.all())
+        version = repository.latest_version()
+        self.first_stage = DebFirstStage(remote, previous_version=version, base_version=version)
+
+    def _pks(self, *names):
+        pks = set()
+        for name in names:
+            package_release_component = self.package_release_components[name]
+            pks.update((package_release_component.pk, package_release_component.package_id))
+        return pks
+
+    def test_base_package_release_components(self):
+        """
+        Test that the packages of an architecture are mapped onto their primary keys.
+        """
+        self.assertEqual(
+            self.first_stage._base_package_release_components(self.release_component, "ppc64"),
+            {
+                ("pool/{}.deb".format(name), name): (
+                    self.package_release_components[name].pk,
+                    self.package_release_components[name].package_id,
+                )
+                for name in ("frigg", "odin")
+            },
+        )
+
+    def test_carry_over_package_index(self):
+        """
+        Test that an unchanged package index is carried over with the packages of its architecture.
+        """
+        self.first_stage._carry_over_package_index(
+            self.package_index, self.release_component, "ppc64"
+        )
+        self.assertEqual(
+            self.first_stage.carried_over, {self.package_index.pk} | self._pks("frigg", "odin")
+        )
+
+    def test_link_packages(self):
+        """
+        Test that package release components are carried over instead of passing the pipeline.
+        """
+        package = Package.objects.create(
+            package="loki",
+            version="1.0",
+            architecture="ppc64",
+            maintainer="Asgard",
+            description="A god.",
+            relative_path="pool/loki.deb",
+            sha256="loki",
+        )
+        package_dcs = [
+            DeclarativeContent(content=package),
+            DeclarativeContent(content=self.package_release_components["frigg"].package),
+        ]
+        for package_dc in package_dcs:
+            package_dc.resolve()
+        asyncio.get_event_loop().run_until_complete(
+            self.first_stage._link_packages(package_dcs, self.release_component)
+        )
+        self.assertEqual(
+            self.first_stage.carried_over,
+            {
+                PackageReleaseComponent.objects.get(package=package).pk,
+                self.package_release_components["frigg"].pk,
+            },
+        )
+
+
+class TestPdiff(TestCase):
+    """
+    Tests the parsing of Packages.diff/Index files and the application of pdiffs.
+    """
+
+    PDIFF_INDEX = (
+        b"SHA256-Current: cccc 300\n"
+        b"SHA256-History:\n"
+        b" aaaa 100 T-2021-01-01-0000.00-F-2021-01-01-0000.00\n"
+        b" bbbb 200 T-2021-01-02-0000.00-F-2021-01-02-0000.00\n"
+        b"SHA256-Patches:\n"
+        b" 1111 10 T-2021-01-01-0000.00-F-2021-01-01-0000.00\n"
+        b" 2222 20 T-2021-01-02-0000.00-F-2021-01-02-0000.00\n"
+        b"SHA256-Download:\n"
+        b" 3333 30 T-2021-01-01-0000.00-F-2021-01-01-0000.00.gz\n"
+        b" 4444 40 T-2021-01-02-0000.00-F-2021-01-02-0000.00.gz\n"
+    )
+
+    def test_parse_pdiff_index(self):
+        """
+        Test that the history, the patches and the downloads are parsed.
+        """
+        pdiff_index = _parse_pdiff_index(self.PDIFF_INDEX)
+        self.assertEqual(pdiff_index["current"], "cccc")
+        self.assertEqual(
+            pdiff_index["history"],
+            [
+                ("aaaa", "T-2021-01-01-0000.00-F-2021-01-01-0000.00"),
+                ("bbbb", "T-2021-01-02-0000.00-F-2021-01-02-0000.00"),
+            ],
+        )
+        self.assertEqual(
+            pdiff_index["patches"]["T-2021-01-02-0000.00-F-2021-01-02-0000.00"], "2222"
+        )
+        self.assertEqual(
+            pdiff_index["downloads"]["T-2021-01-02-0000.00-F-2021-01-02-0000.00.gz"],
+            ("4444", 40),
+        )
+        self.assertFalse(pdiff_index["merged"])
+
+    def test_pdiff_patch_names(self):
+        """
+        Test that all patches following the base are applied, or only one if they are merged.
+        """
+        pdiff_index = _parse_pdiff_index(self.PDIFF_INDEX)
+        self.assertEqual(
+            _pdiff_patch_names(pdiff_index, "aaaa"),
+            [
+                "T-2021-01-01-0000.00-F-2021-01-01-0000.00",
+                "T-2021-01-02-0000.00-F-2021-01-02-0000.00",
+            ],
+        )
+        self.assertEqual(_pdiff_patch_names(pdiff_index, "cccc"), [])
+        self.assertIsNone(_pdiff_patch_names(pdiff_index, "dddd"))
+
+        pdiff_index = _parse_pdiff_index(self.PDIFF_INDEX + b"X-Patch-Precedence: merged\n")
+        self.assertEqual(
+            _pdiff_patch_names(pdiff_index, "aaaa"), ["T-2021-01-01-0000.00-F-2021-01-01-0000.00"]
+        )
+
+    def test_apply_ed_scripts(self):
+        """
+        Test that append, change and delete commands of consecutive scripts are applied.
+        """
+        base_file = io.BytesIO(b"odin\nfrigg\nthor\nloki\nbaldr\n")
+        scripts = [b"5a\nhodr\n.\n3,4c\nsif\n.\n1d\n", b"0a\nodin\n.\n"]
+        patched_file = io.BytesIO()
+        _apply_ed_scripts(base_file, scripts, patched_file)
+        self.assertEqual(patched_file.getvalue(), b"odin\nfrigg\nsif\nbaldr\nhodr\n")
+
+        for script in (b"1a\nbragi\n", b"w\n", b"1d\n3,4d\n", b"9d\n"):
+            with self.subTest(script=script), self.assertRaises(ValueError):
+                _apply_ed_scripts(io.BytesIO(b"odin\nfrigg\n"), [script], io.BytesIO())
+
+
+class TestConcurrencyLimit(TestCase):
+    """
+    Tests that _ConcurrencyLimit bounds the number of concurrently running coroutines.
+    """
+
+    def _max_concurrency(self, limit):
+        running = []
+        concurrency = []
+
+        async def work(value):
+            running.append(value)
+            concurrency.append(len(running))
+            await asyncio.sleep(0)
+            running.remove(value)
+            return value
+
+        concurrency_limit = _ConcurrencyLimit(limit)
+        results = asyncio.get_event_loop().run_until_complete(
+            concurrency_limit.gather([work(value) for value in range(10)])
+        )
+        self.assertEqual(results, list(range(10)))
+        return max(concurrency)
+
+    def test_limit(self):
+        """
+        Test that no more coroutines than the limit run at a time.
+        """
+        self.assertEqual(self._max_concurrency(3), 3)
+        self.assertEqual(self._max_concurrency(1), 1)
+
+    def test_no_limit(self):
+        """
+        Test that all coroutines run at a time without a limit.
+        """
+        self.assertEqual(self._max_concurrency(None), 10)
+
+
+class TestStageStatistics(TestCase):
+    """
+    Tests the StageStatistics collected about the stages of a pipeline, using a fake clock.
+    """
+
+    class Clock:
+        def __init__(self):
+            self.now = 0
+
+        def __call__(self):
+            return self.now
+
+    def setUp(self):
+        """Setup a stage, whose input takes 2s per item and whose output takes 4s per item."""
+        self.clock = self.Clock()
+        self.stage = Stage()
+        contents = []
+        for i in range(10):
+            if i % 2:
+                contents.append(Package(package="odin", version=str(i), architecture="all"))
+            else:
+                contents.append(Release(codename="ragnarok", suite="stable", distribution=str(i)))
+        self.d_contents = [DeclarativeContent(content=content) for content in contents]
+
+        async def items():
+            for d_content in self.d_contents:
+                self.clock.now += 2
+                yield d_content
+
+        async def batches(minsize=500):
+            for i in range(0, len(self.d_contents), 5):
+                self.clock.now += 10
+                yield self.d_contents[i : i + 5]
+
+        async def put(item):
+            self.clock.now += 4
+
+        self.stage.items, self.stage.batches, self.stage.put = items, batches, put
+        self.clock.now = 100
+        self.statistics = _measure_stage(self.stage, 100, self.clock)
+
+    def _run(self, use_batches):
+        async def run():
+            if use_batches:
+                async for batch in self.stage.batches():
+                    for d_content in batch:
+                        self.clock.now += 1
+                        await self.stage.put(d_content)
+            else:
+                async for d_content in self.stage.items():
+                    self.clock.now += 1
+                    await self.stage.put(d_content)
+
+        asyncio.get_event_loop().run_until_complete(run())
+
+    def _assert_statistics(self):
+        self.assertEqual(self.statistics.items, 10)
+        self.assertEqual(self.statistics.packages, 5)
+        self.assertEqual(self.statistics.input_blocked, 20)
+        self.assertEqual(self.statistics.output_blocked, 40)
+        self.assertEqual(self.statistics.busy, 10)
+        self.assertEqual(self.statistics.duration, 70)
+        self.assertEqual(self.statistics.end, self.clock.now)
+
+    def test_items(self):
+        """
+        Test the statistics of a stage consuming its input item by item.
+        """
+        self._run(use_batches=False)
+        self._assert_statistics()
+
+    def test_batches(self):
+        """
+        Test the statistics of a stage consuming its input in batches.
+        """
+        self._run(use_batches=True)
+        self._assert_statistics()
+
+    def test_str(self):
+        """
+        Test that the statistics are reported with the rate of items.
+        """
+        self._run(use_batches=False)
+        self.assertEqual(
+            str(self.statistics),
+            "Stage Stage: 10 items (0/s), 5 packages, busy 10.0s, waiting for input 20.0s, "
+            "waiting for output 40.0s",
+        )